@@ -1,8 +1,41 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Request, Response, Header
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from starlette.background import BackgroundTask
+import hashlib
+import hmac
+import json
+import time
 import uvicorn
 import os
-from database import db
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import parse_qsl
+from uuid import uuid4
+from log_config import setup_logging, request_id_var
+from database import db, Database
+from cache import TTLCache
+from export import EXPORT_FORMATS, export_filename, parse_date, spool
+from search import CityPrefixIndex, search_key
+from geo import GeoGrid, valid_coordinates
+import metrics
+from config import (
+    CITY_CACHE_SIZE, CITY_CACHE_TTL, SERVICE_CACHE_SIZE, SERVICE_CACHE_TTL,
+    HTTP_MAX_AGE_SERVICE, HTTP_MAX_AGE_CITY,
+    AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_CACHE_SIZE, AUTOCOMPLETE_CACHE_TTL,
+    GEO_CELL_DEG, GEO_MAX_RADIUS_KM,
+    BOT_MODE, WEBHOOK_PATH, WEBHOOK_SECRET, METRICS_ENABLED,
+    BOT_TOKEN, EXPORT_AUTH_MAX_AGE, STATUS_LABELS
+)
+
+setup_logging("api")
+
+# В webhook-режиме бот живёт в этом же процессе и делит с API пул БД
+bot_app = None
+if BOT_MODE == "webhook":
+    import bot as bot_app
 
 app = FastAPI(title="AutoService API")
 
@@ -14,37 +47,299 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Request-ID", "Content-Disposition"],
 )
 
+def telegram_user_id(init_data: str) -> Optional[int]:
+    """
+    id пользователя из initData Telegram Web App, если подпись верна и не устарела.
+    https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+    """
+    if not BOT_TOKEN:
+        return None
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received = fields.pop("hash", "")
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    if not received or not hmac.compare_digest(expected, received):
+        return None
+    try:
+        if time.time() - int(fields.get("auth_date", "0")) > EXPORT_AUTH_MAX_AGE:
+            return None
+        return int(json.loads(fields.get("user", "{}"))["id"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def require_owner(authorization: str) -> int:
+    """id владельца из заголовка Authorization: tma <initData>, иначе 401"""
+    user_id = telegram_user_id(authorization.removeprefix("tma ").strip())
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Invalid Telegram init data")
+    return user_id
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """request_id во всех записях лога запроса (и в ответе — для поиска по логам)"""
+    request_id = request.headers.get("x-request-id") or uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+# Кеши ответов: ключ -> (etag, payload)
+# city_cache: нормализованный город -> список сервисов
+# service_cache: service_id -> карточка сервиса
+city_cache = TTLCache(maxsize=CITY_CACHE_SIZE, ttl=CITY_CACHE_TTL)
+service_cache = TTLCache(maxsize=SERVICE_CACHE_SIZE, ttl=SERVICE_CACHE_TTL)
+# autocomplete_cache: нормализованный запрос -> подсказки
+autocomplete_cache = TTLCache(maxsize=AUTOCOMPLETE_CACHE_SIZE, ttl=AUTOCOMPLETE_CACHE_TTL)
+# Справочник городов для подсказок: грузится при старте, пополняется по NOTIFY
+city_index = CityPrefixIndex()
+# Сервисы с координатами для /api/services/nearby: грузится при старте, пополняется по NOTIFY
+geo_index = GeoGrid(cell_deg=GEO_CELL_DEG)
+
+def city_key(city: str) -> str:
+    # Все написания города («Королёв», «Королев») делят одну запись кеша
+    return search_key(city)
+
+def on_services_changed(conn, pid, channel, payload):
+    city_cache.invalidate(city_key(payload))
+    city_index.add(payload)
+    autocomplete_cache.clear()
+
+def geo_entry(service) -> dict:
+    return {k: service[k] for k in ("idservice", "service_name", "service_number",
+                                    "location_service", "city")}
+
+def on_service_geo(conn, pid, channel, payload):
+    service = json.loads(payload)
+    geo_index.upsert(service['idservice'], service['lat'], service['lon'], geo_entry(service))
+
+def make_etag(payload) -> str:
+    """Сильный ETag — хеш канонического JSON ответа"""
+    body = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def version_etag(count: int, updated_at: Optional[datetime]) -> str:
+    """
+    ETag от версии данных (число сервисов и их последнее изменение, services.updated_at):
+    при промахе кеша If-None-Match сверяется одной индексной пробой, без полного запроса
+    """
+    stamp = (updated_at - EPOCH) // timedelta(microseconds=1) if updated_at else 0
+    return f'"v{count}-{stamp}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Для If-None-Match используется слабое сравнение: W/"x" совпадает с "x"
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags
+
+def cached_response(request: Request, etag: str, payload, max_age: int) -> Response:
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+if METRICS_ENABLED:
+    metrics.instrument_database(Database)
+    metrics.instrument_pool(db)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+async def reload_services():
+    """
+    Справочник городов и гео-индекс из БД. После переподключения LISTEN
+    (уведомления за обрыв потеряны) заодно сбрасываются кеши ответов
+    """
+    cities = await db.get_city_counts()
+    located = await db.get_located_services()
+    city_index.load((r['city'], r['services']) for r in cities)
+    geo_index.clear()
+    for r in located:
+        geo_index.upsert(r['idservice'], r['lat'], r['lon'], geo_entry(r))
+    city_cache.clear()
+    service_cache.clear()
+    autocomplete_cache.clear()
+
 @app.on_event("startup")
 async def startup():
     await db.connect()
+    await db.listen("services_changed", on_services_changed, on_reconnect=reload_services)
+    await db.listen("services_geo", on_service_geo, on_reconnect=reload_services)
+    await reload_services()
+    if bot_app:
+        await bot_app.start_webhook()
 
 @app.on_event("shutdown")
 async def shutdown():
+    if bot_app:
+        await bot_app.stop_webhook()
     await db.close()
 
+if bot_app:
+    @app.post(WEBHOOK_PATH, include_in_schema=False)
+    async def telegram_webhook(request: Request):
+        secret = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(secret, WEBHOOK_SECRET):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        # Отвечаем Telegram сразу, апдейт обрабатывается в фоне
+        bot_app.feed_webhook_update(await request.json())
+        return {"ok": True}
+
 @app.get("/api/services")
-async def services_by_city(city: str = Query(..., min_length=1)):
-    try:
-        services = await db.get_services_by_city(city)
-        return [dict(s) for s in services] if services else []
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def services_by_city(request: Request, city: str = Query(..., min_length=1)):
+    # «санкт петербург» -> все написания «Санкт-Петербурга» из справочника
+    known = city_index.lookup(city)
+    cities = known["spellings"] if known else [city]
+    key = city_key(city)
+    cached = city_cache.get(key)
+    if cached is None:
+        try:
+            if request.headers.get("if-none-match"):
+                etag = version_etag(*await db.get_city_version(*cities))
+                if etag_matches(request.headers.get("if-none-match"), etag):
+                    return cached_response(request, etag, None, HTTP_MAX_AGE_CITY)
+            services = await db.get_services_by_city(*cities)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        rows = [dict(s) for s in services]
+        updated = [row.pop("updated_at") for row in rows]
+        payload = jsonable_encoder(rows)
+        cached = (version_etag(len(rows), max(updated, default=None)), payload)
+        city_cache.set(key, cached)
+    etag, payload = cached
+    return cached_response(request, etag, payload, HTTP_MAX_AGE_CITY)
+
+@app.get("/api/autocomplete")
+async def autocomplete(request: Request, q: str = Query(..., min_length=1, max_length=64),
+                       limit: int = Query(AUTOCOMPLETE_LIMIT, ge=1, le=20)):
+    """
+    Подсказки для поля города: города по префиксу из памяти, затем нечёткие
+    совпадения городов и названий сервисов из БД (pg_trgm). Рассчитано на вызов
+    на каждое нажатие с debounce на клиенте.
+    """
+    key = f"{search_key(q)}|{limit}"
+    cached = autocomplete_cache.get(key)
+    if cached is None:
+        cities = city_index.prefix(q, limit)
+        services = []
+        if len(search_key(q)) >= 2:
+            try:
+                rows = await db.search_autocomplete(search_key(q), limit)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+            seen = {c["city"] for c in cities}
+            for r in rows:
+                if r['kind'] == "city":
+                    if len(cities) < limit and r['label'] not in seen:
+                        known = city_index.lookup(r['label'])
+                        cities.append({"city": known["city"], "services": known["services"]}
+                                      if known else {"city": r['label'], "services": 0})
+                        seen.add(r['label'])
+                else:
+                    services.append({"idservice": r['idservice'], "service_name": r['label'],
+                                     "city": r['city'], "score": round(r['score'], 3)})
+        payload = {"cities": cities, "services": services}
+        cached = (make_etag(payload), payload)
+        autocomplete_cache.set(key, cached)
+    etag, payload = cached
+    return cached_response(request, etag, payload, HTTP_MAX_AGE_CITY)
+
+@app.get("/api/services/nearby")
+async def services_nearby(lat: float, lon: float,
+                          limit: int = Query(10, ge=1, le=50),
+                          radius_km: float = Query(GEO_MAX_RADIUS_KM, gt=0)):
+    """k ближайших сервисов — из гео-индекса в памяти, без запроса к БД"""
+    if not valid_coordinates(lat, lon):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    found = geo_index.nearest(lat, lon, limit, max_km=min(radius_km, GEO_MAX_RADIUS_KM))
+    return [{**service, "distance_km": round(distance, 2)} for distance, service in found]
 
 # ✅ НОВЫЙ ЭНДПОИНТ: получить название сервиса по ID
 @app.get("/api/service/{service_id}")
-async def get_service(service_id: str):
-    try:
-        service = await db.get_service_by_id(service_id)
+async def get_service(request: Request, service_id: str):
+    cached = service_cache.get(service_id)
+    if cached is None:
+        try:
+            if request.headers.get("if-none-match"):
+                updated_at = await db.get_service_version(service_id)
+                etag = version_etag(1, updated_at)
+                if updated_at and etag_matches(request.headers.get("if-none-match"), etag):
+                    return cached_response(request, etag, None, HTTP_MAX_AGE_SERVICE)
+            service = await db.get_service_by_id(service_id)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
         if not service:
             raise HTTPException(status_code=404, detail="Service not found")
-        return dict(service)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        row = dict(service)
+        etag = version_etag(1, row.pop("updated_at"))
+        cached = (etag, jsonable_encoder(row))
+        service_cache.set(service_id, cached)
+    etag, payload = cached
+    return cached_response(request, etag, payload, HTTP_MAX_AGE_SERVICE)
+
+@app.get("/api/service/{service_id}/export")
+async def export_requests(
+    service_id: str,
+    format: str = Query("csv"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    status: Optional[str] = None,
+    authorization: str = Header(""),
+):
+    """
+    Выгрузка заявок сервиса для его владельца (Authorization: tma <initData>).
+    Курсор дочитывается во временный файл, и клиенту отдаётся файл: медленная
+    загрузка не держит соединение с БД и открытую транзакцию
+    """
+    user_id = require_owner(authorization)
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format: csv | jsonl")
+    if status and status != "new" and status not in STATUS_LABELS:
+        raise HTTPException(status_code=400, detail="Unknown status")
+    try:
+        start, end = parse_date(date_from), parse_date(date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+
+    owned = await db.get_owned_services(user_id)
+    if not any(s['idservice'] == service_id for s in owned):
+        raise HTTPException(status_code=403, detail="Not the service owner")
+
+    path, _ = await spool(db.iter_service_requests(service_id, start, end, status), format)
+    return FileResponse(
+        path,
+        media_type=EXPORT_FORMATS[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{export_filename(service_id, format)}"',
+            "Cache-Control": "no-store",
+        },
+        background=BackgroundTask(os.unlink, path),
+    )
+
+@app.get("/api/service/{service_id}/stats")
+async def service_stats(
+    service_id: str,
+    days: int = Query(30, ge=1, le=366),
+    authorization: str = Header(""),
+):
+    """Аналитика сервиса для владельца — из предрасчитанных агрегатов, один запрос"""
+    user_id = require_owner(authorization)
+    stats = await db.get_service_stats([service_id], days=days, owner_id=user_id)
+    if not stats:
+        raise HTTPException(status_code=404, detail="Service not found")
+    return JSONResponse(stats[0], headers={"Cache-Control": "private, no-cache"})
 
 if __name__ == "__main__":
     uvicorn.run("api:app", host="0.0.0.0", port=int(os.getenv("PORT", 8080)), reload=True)
-    
\ No newline at end of file
@@ -0,0 +1,353 @@
+"""
+Бенчмарк методов Database на засеянной локальной БД.
+
+    python -m bench.db_bench --db auto_service_bench --seed-data
+    python -m bench.db_bench --db auto_service_bench -o after.json --compare before.json
+
+Засеивает отдельную БД (по умолчанию 100k сервисов, 1M заявок, перекошенные
+распределения городов / админов / заявок), меряет каждый метод Database
+(p50/p95/p99 и число round-trip'ов на вызов) и пишет JSON, который можно
+сравнить с результатом другого коммита.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from uuid import uuid4
+
+import asyncpg
+from config import PG_USER, PG_PASSWORD, PG_HOST, PG_PORT, PG_DB
+from database import db, OutboxMessage
+from migrations import migrate
+
+STATUSES = ["new", "accepted", "called", "rejected"]
+SERVICE_TYPES = ["diagnostic", "oil-change", "tires", "brake", "engine", "other"]
+
+
+class RoundTripCounter:
+    """Считает запросы к Postgres через query logger asyncpg"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, record):
+        self.count += 1
+
+
+def zipf_cum_weights(n: int, s: float = 1.1) -> list[float]:
+    """Накопленные веса Zipf: rnd.choices(cum_weights=...) без пересчёта на каждый вызов"""
+    return list(accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+
+# ===== ЗАСЕВ =====
+async def seed(pool, rnd: random.Random, services: int, requests: int, cities: int,
+               admins: int):
+    print(f"🌱 Засев: {services} сервисов, {requests} заявок, {cities} городов, {admins} админов")
+    city_names = [f"Город-{i}" for i in range(cities)]
+    admin_ids = list(range(10_000_000, 10_000_000 + admins))
+    admin_cum = zipf_cum_weights(admins, 0.9)
+
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """TRUNCATE requests, admins, services, outbox, processed_updates, fsm_storage,
+                        service_daily_stats CASCADE"""
+        )
+
+        service_rows = []
+        service_cities = rnd.choices(city_names, cum_weights=zipf_cum_weights(cities), k=services)
+        for i, city in enumerate(service_cities):
+            # Регистр и пробелы разные, как их вводят люди
+            city = rnd.choice([city, city.lower(), f" {city} "])
+            service_rows.append((
+                str(uuid4()), f"Сервис {i}", f"+7999{i:07d}", rnd.choice(admin_ids),
+                f"ул. Тестовая, {i}", city
+            ))
+        await conn.copy_records_to_table(
+            "services", records=service_rows,
+            columns=["idservice", "service_name", "service_number", "owner_id",
+                     "location_service", "city"]
+        )
+        service_ids = [r[0] for r in service_rows]
+
+        # У большинства сервисов 1–2 админа, немногие админы ведут очень много сервисов
+        admin_rows = set()
+        for idservice in service_ids:
+            for admin_id in rnd.choices(admin_ids, cum_weights=admin_cum, k=rnd.choice([1, 1, 2, 3])):
+                admin_rows.add((idservice, admin_id))
+        await conn.copy_records_to_table(
+            "admins",
+            records=[(str(uuid4()), svc, adm, 0 if rnd.random() > 0.05 else -1)
+                     for svc, adm in admin_rows],
+            columns=["idadmins", "idservice", "idusertg", "idrecstatus"]
+        )
+
+        # Заявки: популярные сервисы получают непропорционально много
+        request_services = rnd.choices(
+            service_ids, cum_weights=zipf_cum_weights(services, 0.8), k=requests
+        )
+        now = datetime.now(timezone.utc)
+        batch = []
+        for i, idservice in enumerate(request_services):
+            batch.append((
+                str(uuid4()), idservice,
+                f"Клиент {i}", f"+7900{i:07d}", "Lada", "Vesta", f"A{i % 1000:03d}AA",
+                rnd.choice(SERVICE_TYPES), "medium", "", 20_000_000 + i % 500_000,
+                rnd.choice(STATUSES), now - timedelta(minutes=rnd.randint(0, 3 * 365 * 24 * 60))
+            ))
+            if len(batch) == 50_000:
+                await _copy_requests(conn, batch)
+                batch.clear()
+        if batch:
+            await _copy_requests(conn, batch)
+        await conn.execute("ANALYZE")
+    print("✅ Засев завершён")
+
+
+async def _copy_requests(conn, rows):
+    await conn.copy_records_to_table(
+        "requests", records=rows,
+        columns=["idrequests", "idservice", "client_name", "phone", "brand", "model",
+                 "plate", "service_type", "urgency", "comment", "idclienttg", "status",
+                 "createdate"]
+    )
+
+
+# ===== ВЫБОРКИ ДЛЯ НАГРУЗКИ =====
+async def sample_ids(pool, rnd: random.Random) -> dict:
+    async with pool.acquire() as conn:
+        services = await conn.fetch(
+            "SELECT idservice, owner_id, city FROM services TABLESAMPLE SYSTEM (1) LIMIT 2000"
+        )
+        admins = await conn.fetch(
+            "SELECT idservice, idusertg FROM admins TABLESAMPLE SYSTEM (5) "
+            "WHERE idrecstatus = 0 LIMIT 2000"
+        )
+        # Самые «тяжёлые» админы — худший случай для «Мои заявки»
+        heavy = await conn.fetch(
+            """SELECT idusertg FROM admins WHERE idrecstatus = 0
+               GROUP BY idusertg ORDER BY count(*) DESC LIMIT 50"""
+        )
+        requests = await conn.fetch(
+            "SELECT idrequests FROM requests TABLESAMPLE SYSTEM (0.1) LIMIT 2000"
+        )
+    return {
+        "services": [r['idservice'] for r in services],
+        "owners": [r['owner_id'] for r in services],
+        "cities": [r['city'] for r in services],
+        "memberships": [(r['idservice'], r['idusertg']) for r in admins],
+        "admins": [r['idusertg'] for r in admins] + [r['idusertg'] for r in heavy],
+        "requests": [r['idrequests'] for r in requests],
+    }
+
+
+def workloads(ids: dict, rnd: random.Random) -> dict:
+    """Метод -> фабрика корутины одного вызова со случайными аргументами"""
+    pick = rnd.choice
+    update_ids = iter(range(1, 10**9))
+
+    async def requests_page():
+        idservice, admin_id = pick(ids["memberships"])
+        return await db.get_requests_page(admin_id, idservice=idservice)
+
+    async def export_service():
+        # Выгрузка целиком: курсор дочитывается до конца
+        async for _ in db.iter_service_requests(pick(ids["services"])):
+            pass
+
+    def notify_admins(admins):
+        return [OutboxMessage("new_request", a['idusertg'], "bench") for a in admins]
+
+    async def add_request_burst():
+        # 20 одновременных заявок: с REQUEST_BATCHING=1 уходят одной пачкой
+        await asyncio.gather(*(
+            db.add_request(
+                pick(ids["services"]), "Бенч", "+79000000000", "Lada", "Vesta", "A000AA",
+                "diagnostic", "medium", "", 1,
+                notify=notify_admins
+            ) for _ in range(20)
+        ))
+
+    async def claim_and_complete_outbox():
+        rows = await db.claim_outbox(50, 60)
+        await db.complete_outbox([r['id'] for r in rows], [])
+
+    return {
+        "get_service_by_owner": lambda: db.get_service_by_owner(pick(ids["owners"])),
+        "get_service_by_id": lambda: db.get_service_by_id(pick(ids["services"])),
+        "get_owned_services": lambda: db.get_owned_services(pick(ids["owners"])),
+        "get_admin_services": lambda: db.get_admin_services(pick(ids["admins"])),
+        "get_admins_by_service": lambda: db.get_admins_by_service(pick(ids["services"])),
+        "get_all_admins_by_service": lambda: db.get_all_admins_by_service(pick(ids["services"])),
+        "get_request": lambda: db.get_request(pick(ids["requests"])),
+        "get_service_requests": lambda: db.get_service_requests(pick(ids["services"])),
+        "get_admin_recent_requests": lambda: db.get_admin_recent_requests(pick(ids["admins"])),
+        "get_requests_page": requests_page,
+        "iter_service_requests": export_service,
+        "get_services_by_city": lambda: db.get_services_by_city(pick(ids["cities"])),
+        "search_autocomplete": lambda: db.search_autocomplete(pick(ids["cities"])[:4].lower(), 8),
+        "get_city_counts": lambda: db.get_city_counts(),
+        "get_service_stats": lambda: db.get_service_stats([pick(ids["services"])], days=30),
+        "add_service": lambda: db.add_service(
+            "Бенч-сервис", "+79990000000", pick(ids["owners"]), "ул. Бенч", pick(ids["cities"])
+        ),
+        "add_admin": lambda: db.add_admin(*pick(ids["memberships"])),
+        "remove_admin": lambda: db.remove_admin(*pick(ids["memberships"])),
+        "add_request": lambda: db.add_request(
+            pick(ids["services"]), "Бенч", "+79000000000", "Lada", "Vesta", "A000AA",
+            "diagnostic", "medium", "", 1,
+            notify=notify_admins
+        ),
+        "add_request x20 concurrent": add_request_burst,
+        "update_request_status": lambda: db.update_request_status(
+            pick(ids["requests"]), pick(STATUSES)
+        ),
+        "transition_request_status": lambda: db.transition_request_status(
+            pick(ids["requests"]), pick(STATUSES), "bench"
+        ),
+        "enqueue": lambda: db.enqueue(OutboxMessage("bench", 1, "bench")),
+        "claim_outbox+complete_outbox": claim_and_complete_outbox,
+        "claim_update": lambda: db.claim_update(next(update_ids)),
+        "purge_processed_updates": lambda: db.purge_processed_updates(86400),
+    }
+
+
+# ===== ЗАМЕРЫ =====
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+async def run_method(factory, counter: RoundTripCounter, iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        await factory()
+    latencies, round_trips = [], []
+    for _ in range(iterations):
+        # Кеши Database выключаем — меряем именно поход в БД
+        db.role_cache.clear()
+        db.request_cache.clear()
+        before = counter.count
+        started = time.perf_counter()
+        await factory()
+        latencies.append((time.perf_counter() - started) * 1000)
+        round_trips.append(counter.count - before)
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "round_trips": round(sum(round_trips) / len(round_trips), 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """Печатает сравнение; True — есть регрессия p95 больше threshold"""
+    regressed = False
+    print(f"\n{'метод':<32}{'p95 было':>12}{'p95 стало':>12}{'Δ':>9}{'RT было':>9}{'RT стало':>9}")
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            print(f"{name:<32}{'—':>12}{cur['p95_ms']:>12.3f}")
+            continue
+        delta = (cur["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        flag = ""
+        if delta > threshold or cur["round_trips"] > base["round_trips"]:
+            regressed = True
+            flag = "  ❌"
+        print(f"{name:<32}{base['p95_ms']:>12.3f}{cur['p95_ms']:>12.3f}{delta:>+9.0%}"
+              f"{base['round_trips']:>9}{cur['round_trips']:>9}{flag}")
+    return regressed
+
+
+async def main(args) -> int:
+    if args.db == PG_DB and not args.force:
+        print(f"❌ --db совпадает с рабочей БД {PG_DB!r}: засев её очистит. Укажите --force, если уверены")
+        return 2
+
+    rnd = random.Random(args.seed)
+    counter = RoundTripCounter()
+
+    async def init(conn):
+        conn.add_query_logger(counter)
+
+    db.pool = await asyncpg.create_pool(
+        user=PG_USER, password=PG_PASSWORD, database=args.db,
+        host=PG_HOST, port=PG_PORT, min_size=2, max_size=10, init=init
+    )
+    try:
+        await migrate(db.pool)
+        if args.seed_data:
+            await seed(db.pool, rnd, args.services, args.requests, args.cities, args.admins)
+
+        ids = await sample_ids(db.pool, rnd)
+        methods = workloads(ids, rnd)
+        selected = [m for m in methods if not args.only or m in args.only]
+
+        results = {}
+        for name in selected:
+            results[name] = await run_method(methods[name], counter, args.iterations, args.warmup)
+            r = results[name]
+            print(f"{name:<32} p50 {r['p50_ms']:>8.3f}  p95 {r['p95_ms']:>8.3f}  "
+                  f"p99 {r['p99_ms']:>8.3f} ms  RT {r['round_trips']}")
+    finally:
+        await db.pool.close()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "iterations": args.iterations,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 Результаты: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Бенчмарк методов Database")
+    p.add_argument("--db", default="auto_service_bench", help="отдельная БД для бенчмарка")
+    p.add_argument("--force", action="store_true", help="разрешить --db, совпадающую с PG_DB")
+    p.add_argument("--seed-data", action="store_true", help="очистить и засеять БД")
+    p.add_argument("--services", type=int, default=100_000)
+    p.add_argument("--requests", type=int, default=1_000_000)
+    p.add_argument("--cities", type=int, default=500)
+    p.add_argument("--admins", type=int, default=60_000)
+    p.add_argument("--iterations", type=int, default=200)
+    p.add_argument("--warmup", type=int, default=20)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--only", nargs="*", help="мерить только эти методы")
+    p.add_argument("-o", "--output", default="bench_results.json")
+    p.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    p.add_argument("--threshold", type=float, default=0.2,
+                   help="допустимый рост p95 (доля) при --compare")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,86 @@
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Отвечает на методы, которые вызывает бот (sendMessage, editMessageText,
+answerCallbackQuery, getChat и служебные), с настраиваемой задержкой
+и долей ответов 429 (flood control).
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from aiohttp import web
+
+
+class FakeTelegramAPI:
+    def __init__(self, latency_ms: float = 30, jitter_ms: float = 10,
+                 p429: float = 0.0, retry_after: int = 1, seed: int = 42):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.p429 = p429
+        self.retry_after = retry_after
+        self.rnd = random.Random(seed)
+        self.calls = Counter()
+        self.flood_errors = 0
+        self._message_id = 0
+        # Вызывается на каждый успешный sendMessage: (chat_id, text, reply_markup, время)
+        self.on_send: Optional[Callable[[int, str, Optional[dict], float], None]] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> str:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+
+        delay = max(0.0, self.latency_ms + self.rnd.uniform(-self.jitter_ms, self.jitter_ms))
+        await asyncio.sleep(delay / 1000)
+
+        if method in ("sendMessage", "editMessageText") and self.rnd.random() < self.p429:
+            self.flood_errors += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _result(self, method: str, params: dict):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+            if method == "sendMessage" and self.on_send:
+                self.on_send(chat_id, params.get("text", ""), markup, time.perf_counter())
+            return {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        if method == "getChat":
+            return {
+                "id": chat_id, "type": "private", "accent_color_id": 0,
+                "max_reaction_count": 0,
+                "accepted_gift_types": {
+                    "unlimited_gifts": False, "limited_gifts": False,
+                    "unique_gifts": False, "premium_subscription": False,
+                },
+            }
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        return True
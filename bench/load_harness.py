@@ -0,0 +1,260 @@
+"""
+Сквозной нагрузочный тест бота без настоящего Telegram.
+
+    python -m bench.load_harness --db auto_service_bench --rate 50 --duration 60 --p429 0.02
+
+Поднимает FakeTelegramAPI, направляет в него Bot из bot.py и подаёт в настоящий
+Dispatcher синтетические web_app_data-заявки и колбэки смены статуса с заданной
+частотой. В конце печатает (и при -o пишет в JSON) задержку обработки апдейта,
+время доставки карточки админу, пропускную способность, число запросов к БД
+на апдейт и загрузку пула соединений.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+from itertools import count
+
+from bench.fake_telegram import FakeTelegramAPI
+
+CARD_NAME = re.compile(r"Имя: <b>(load-\d+)</b>")
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round((len(values) - 1) * p)))]
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50), 2),
+        "p95_ms": round(percentile(values, 0.95), 2),
+        "p99_ms": round(percentile(values, 0.99), 2),
+        "max_ms": round(max(values), 2) if values else 0.0,
+    }
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.update_ids = count(1)
+        self.fake = FakeTelegramAPI(args.latency_ms, args.jitter_ms, args.p429, seed=args.seed)
+        self.fake.on_send = self._on_send
+        self.queries = 0
+        self.handler_ms: dict[str, list[float]] = {"web_app_data": [], "callback": []}
+        self.delivery_ms: list[float] = []
+        self.errors = 0
+        self.submitted: dict[str, float] = {}
+        self.request_ids: list[str] = []
+        self.pool_samples: list[tuple[int, int]] = []
+
+    # ----- наблюдение -----
+    def _on_query(self, record):
+        self.queries += 1
+
+    def _on_send(self, chat_id, text, markup, at):
+        match = CARD_NAME.search(text)
+        if match and match.group(1) in self.submitted:
+            self.delivery_ms.append((at - self.submitted.pop(match.group(1))) * 1000)
+        # Из кнопок карточки берём id заявок для колбэков статуса
+        for row in (markup or {}).get("inline_keyboard", []):
+            for button in row:
+                data = button.get("callback_data", "")
+                if data.startswith("status:"):
+                    self.request_ids.append(data.rsplit(":", 1)[1])
+                    return
+
+    async def _sample_pool(self, pool):
+        while True:
+            self.pool_samples.append((pool.get_size(), pool.get_idle_size()))
+            await asyncio.sleep(0.05)
+
+    # ----- синтетические апдейты -----
+    def _web_app_update(self, seq: int, service_id: str) -> dict:
+        user_id = 30_000_000 + seq
+        return {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": seq, "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+                "web_app_data": {
+                    "button_text": "🚗 Записаться онлайн",
+                    "data": json.dumps({
+                        "service_id": service_id, "client_name": f"load-{seq}",
+                        "phone": "+79000000000", "brand": "Lada", "model": "Vesta",
+                        "plate": "A000AA", "service": "diagnostic", "urgency": "medium",
+                        "comment": "",
+                    }),
+                },
+            },
+        }
+
+    def _callback_update(self, admin_id: int, request_id: str) -> dict:
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(self.rnd.getrandbits(48)),
+                "from": {"id": admin_id, "is_bot": False, "first_name": "Admin"},
+                "chat_instance": "load",
+                "data": f"status:{self.rnd.choice(['accepted', 'called', 'rejected'])}:{request_id}",
+                "message": {
+                    "message_id": 1, "date": int(time.time()),
+                    "chat": {"id": admin_id, "type": "private"},
+                    "text": "НОВАЯ ЗАЯВКА",
+                },
+            },
+        }
+
+    async def _feed(self, kind: str, data: dict):
+        from aiogram.types import Update
+        update = Update.model_validate(data, context={"bot": self.bot})
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            self.errors += 1
+        self.handler_ms[kind].append((time.perf_counter() - started) * 1000)
+
+    # ----- сценарий -----
+    async def run(self) -> dict:
+        args = self.args
+        base_url = await self.fake.start(port=args.port)
+
+        # Проектные модули читают конфиг при импорте — подменяем до него
+        os.environ["PG_DB"] = args.db
+        os.environ.setdefault("BOT_TOKEN", "123456:LOAD-TEST")
+        os.environ["BOT_MODE"] = "polling"
+        # Синтетическая нагрузка не должна упираться в лимиты заявок (throttling.py);
+        # чтобы проверить сам шединг, задайте SUBMIT_* явно
+        for name in ("SUBMIT_SERVICE_PER_MINUTE", "SUBMIT_SERVICE_BURST", "SUBMIT_MAX_INFLIGHT"):
+            os.environ.setdefault(name, "1000000")
+        import asyncpg
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        import bot as bot_module
+        from config import PG_USER, PG_PASSWORD, PG_HOST, PG_PORT
+        from database import db
+        from migrations import migrate
+
+        self.bot, self.dp = bot_module.bot, bot_module.dp
+        self.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+
+        async def init(conn):
+            conn.add_query_logger(self._on_query)
+            # При DB_TRACE=1 — ещё и трасса по апдейтам (db_trace.json при закрытии)
+            await db._init_connection(conn)
+
+        db.pool = await asyncpg.create_pool(
+            user=PG_USER, password=PG_PASSWORD, database=args.db,
+            host=PG_HOST, port=PG_PORT, min_size=5, max_size=20, init=init
+        )
+        await migrate(db.pool)
+
+        # Сервисы с админами, на которые пойдут заявки
+        services = []
+        for i in range(args.services):
+            idservice = await db.add_service(f"Load {i}", "+79990000000", 40_000_000 + i,
+                                             "ул. Нагрузочная", "Нагрузочный")
+            admins = [41_000_000 + i * 100 + a for a in range(args.admins_per_service)]
+            for admin_id in admins:
+                await db.add_admin(idservice, admin_id)
+            services.append((idservice, admins))
+
+        bot_module.register_handlers()
+        await bot_module.setup_bot()
+        sampler = asyncio.create_task(self._sample_pool(db.pool))
+
+        print(f"🚀 {args.rate} апдейтов/с в течение {args.duration} с, fake API: {base_url}")
+        tasks = []
+        queries_before = self.queries
+        started = time.perf_counter()
+        interval = 1 / args.rate
+        seq = 0
+        while time.perf_counter() - started < args.duration:
+            seq += 1
+            if self.request_ids and self.rnd.random() < args.callback_share:
+                idservice, admins = self.rnd.choice(services)
+                kind = "callback"
+                data = self._callback_update(self.rnd.choice(admins), self.request_ids.pop())
+            else:
+                idservice, _ = self.rnd.choice(services)
+                kind = "web_app_data"
+                data = self._web_app_update(seq, idservice)
+                self.submitted[f"load-{seq}"] = time.perf_counter()
+            tasks.append(asyncio.create_task(self._feed(kind, data)))
+            # Открытая модель нагрузки: следующий апдейт по расписанию, не дожидаясь ответа
+            await asyncio.sleep(max(0.0, started + seq * interval - time.perf_counter()))
+
+        await asyncio.gather(*tasks)
+        # Даём outbox дослать карточки
+        drain_deadline = time.perf_counter() + args.drain
+        while self.submitted and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+
+        sampler.cancel()
+        max_size = db.pool.get_max_size()
+        await bot_module.outbox_worker.stop()
+        await self.bot.session.close()
+        await db.close()
+        await self.fake.stop()
+
+        updates = sum(len(v) for v in self.handler_ms.values())
+        in_use = [size - idle for size, idle in self.pool_samples]
+        return {
+            "updates": updates,
+            "errors": self.errors,
+            "throughput_per_s": round(updates / elapsed, 2),
+            "handler_latency": {k: summarize(v) for k, v in self.handler_ms.items()},
+            "admin_delivery_latency": summarize(self.delivery_ms),
+            "undelivered_cards": len(self.submitted),
+            "db_round_trips_per_update": round((self.queries - queries_before) / max(updates, 1), 2),
+            "pool": {
+                "max_in_use": max(in_use, default=0),
+                "max_size": max_size,
+                "saturated_share": round(
+                    sum(1 for u in in_use if u >= max_size) / max(len(in_use), 1), 3
+                ),
+            },
+            "telegram": {"calls": dict(self.fake.calls), "flood_429": self.fake.flood_errors},
+        }
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Нагрузочный тест бота с фейковым Bot API")
+    p.add_argument("--db", default="auto_service_bench", help="отдельная БД (будет дополнена тестовыми данными)")
+    p.add_argument("--rate", type=float, default=20, help="апдейтов в секунду")
+    p.add_argument("--duration", type=float, default=30, help="секунд подачи нагрузки")
+    p.add_argument("--drain", type=float, default=30, help="сколько ждать доставки после нагрузки")
+    p.add_argument("--callback-share", type=float, default=0.3, help="доля колбэков статуса")
+    p.add_argument("--services", type=int, default=20)
+    p.add_argument("--admins-per-service", type=int, default=3)
+    p.add_argument("--latency-ms", type=float, default=30, help="задержка fake API")
+    p.add_argument("--jitter-ms", type=float, default=10)
+    p.add_argument("--p429", type=float, default=0.0, help="доля ответов 429")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("-o", "--output", help="записать отчёт в JSON")
+    return p.parse_args()
+
+
+async def main(args) -> int:
+    report = await Harness(args).run()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -2,24 +2,59 @@ import asyncio
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import BotCommand, BotCommandScopeDefault
-from config import BOT_TOKEN
-from database import db
-from handlers import register_service, service_link, client_request, main
+from aiogram.types import BotCommand, BotCommandScopeDefault, Update
+from config import (
+    BOT_TOKEN, FSM_STORAGE, FSM_TTL,
+    BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, UPDATE_DEDUP_TTL,
+    METRICS_ENABLED, BOT_METRICS_PORT
+)
+from database import db, Database
+import metrics
+import tracing
+import throttling
+from log_config import setup_logging, LogContextMiddleware
+from outbox import OutboxWorker
+from fsm_storage import PostgresStorage
+from handlers import register_service, service_link, client_request, export, main
 import os
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging("bot")
 logger = logging.getLogger(__name__)
 
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+storage = PostgresStorage(db, ttl=FSM_TTL) if FSM_STORAGE == "postgres" else MemoryStorage()
 dp = Dispatcher(storage=storage)
+outbox_worker = OutboxWorker(bot)
+dp.update.outer_middleware(LogContextMiddleware())
+
+if METRICS_ENABLED:
+    metrics.instrument_dispatcher(dp)
+    metrics.instrument_database(Database)
+    metrics.instrument_pool(db)
+
+if db.tracer:
+    tracing.instrument_dispatcher(dp, db.tracer)
+
+# Последним среди outer-middleware апдейта: ставит себя перед FSM
+throttling.install(dp, db)
+
+# Фоновые задачи webhook-режима: обработка апдейтов и очистка processed_updates
+_webhook_tasks: set[asyncio.Task] = set()
+_purge_task = None
 
 async def on_startup():
     await db.connect()
+    await setup_bot()
+
+async def setup_bot():
+    """Запуск бота поверх уже подключённой БД (общая часть polling и webhook)"""
+    if isinstance(storage, PostgresStorage):
+        await storage.setup()
+    await outbox_worker.start()
+    await db.watch_roles()
+    if METRICS_ENABLED:
+        # Сессия ставится здесь, а не при импорте: её могут подменить (bench/load_harness.py)
+        metrics.instrument_bot(bot)
 
     # ✅ Убираем кнопку меню и все команды из интерфейса
     await bot.delete_my_commands(scope=BotCommandScopeDefault())
@@ -34,6 +69,7 @@ async def on_startup():
     logger.info(f"BASE_WEBAPP_URL  = {repr(url)}")
     logger.info(f"BOT_USERNAME     = {repr(bot_username)}")
     logger.info(f"MASTER_CHAT_ID   = {repr(master_chat)}")
+    logger.info(f"BOT_MODE         = {repr(BOT_MODE)}")
     logger.info("===================================")
 
     if not url:
@@ -46,6 +82,7 @@ async def on_startup():
     logger.info("✅ Бот запущен и БД подключена")
 
 async def on_shutdown():
+    await outbox_worker.stop()
     await db.close()
     logger.info("❌ Бот остановлен и БД отключена")
 
@@ -54,14 +91,78 @@ def register_handlers():
         client_request.router,
         service_link.router,
         register_service.router,
+        export.router,
         main.router
     )
     logger.info("✅ Обработчики зарегистрированы")
 
+# ===== WEBHOOK (обслуживается из api.py) =====
+async def start_webhook():
+    """Поднять бота внутри api.py: БД уже подключена, апдейты приходят на WEBHOOK_PATH"""
+    if not WEBHOOK_BASE_URL.startswith("https://") or not WEBHOOK_SECRET:
+        raise RuntimeError("Для BOT_MODE=webhook нужны WEBHOOK_BASE_URL (https://) и WEBHOOK_SECRET")
+    register_handlers()
+    await setup_bot()
+    await bot.set_webhook(
+        url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    global _purge_task
+    _purge_task = asyncio.create_task(_purge_updates_loop())
+    logger.info(f"✅ Webhook установлен: {WEBHOOK_PATH}")
+
+async def stop_webhook():
+    # Webhook не удаляем — его продолжают обслуживать другие реплики
+    if _purge_task:
+        _purge_task.cancel()
+    # Даём дообработаться уже принятым апдейтам
+    await asyncio.gather(*_webhook_tasks, return_exceptions=True)
+    await outbox_worker.stop()
+    await dp.fsm.close()
+    await bot.session.close()
+    logger.info("❌ Webhook-бот остановлен")
+
+def feed_webhook_update(data: dict):
+    """Принять апдейт из HTTP-запроса и обработать его в фоне"""
+    update = Update.model_validate(data, context={"bot": bot})
+    _spawn(_process_update(update))
+
+async def _process_update(update: Update):
+    try:
+        if not await db.claim_update(update.update_id):
+            logger.info(f"↩️ Апдейт {update.update_id} уже обработан другой репликой")
+            return
+        await dp.feed_update(bot, update)
+    except Exception as e:
+        logger.error(f"❌ Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+
+async def _purge_updates_loop():
+    while True:
+        try:
+            await db.purge_processed_updates(UPDATE_DEDUP_TTL)
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки processed_updates: {e}")
+        await asyncio.sleep(3600)
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _webhook_tasks.add(task)
+    task.add_done_callback(_webhook_tasks.discard)
+    return task
+
 async def main_async():
+    if BOT_MODE == "webhook":
+        logger.error("❌ BOT_MODE=webhook: бот обслуживается api.py, polling не запускается")
+        return
     await on_startup()
     register_handlers()
+    if METRICS_ENABLED:
+        metrics.start_metrics_server(BOT_METRICS_PORT)
+        logger.info(f"📈 Метрики: http://0.0.0.0:{BOT_METRICS_PORT}/metrics")
     try:
+        # Если раньше был включён webhook, polling без этого не заработает
+        await bot.delete_webhook()
         logger.info("Polling started...")
         await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
@@ -69,4 +170,3 @@ async def main_async():
 
 if __name__ == "__main__":
     asyncio.run(main_async())
-    
\ No newline at end of file
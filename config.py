@@ -9,12 +9,99 @@ URL_SITE = os.getenv("BASE_WEBAPP_URL")
 MASTER_CHAT_ID = int(os.getenv("MASTER_CHAT_ID", "0"))
 BOT_USERNAME = os.getenv("BOT_USERNAME", "CitatAlcw_bot")  # ← НОВОЕ
 
+# Режим получения апдейтов: "polling" (bot.py) или "webhook" (обслуживает api.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")   # https://example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+UPDATE_DEDUP_TTL = float(os.getenv("UPDATE_DEDUP_TTL", "86400"))
+
 # Database
 PG_USER = os.getenv("PG_USER", "postgres")
 PG_PASSWORD = os.getenv("PG_PASSWORD", "password")
 PG_HOST = os.getenv("PG_HOST", "localhost")
 PG_PORT = int(os.getenv("PG_PORT", "5432"))
 PG_DB = os.getenv("PG_DB", "auto_service")
+# Применять миграции при подключении (иначе — вручную: python migrations.py)
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+# Трассировка запросов по апдейтам (отладка N+1, см. tracing.py)
+DB_TRACE = os.getenv("DB_TRACE", "0") == "1"
+DB_TRACE_SLOW_MS = float(os.getenv("DB_TRACE_SLOW_MS", "100"))    # порог EXPLAIN
+DB_TRACE_REPEAT = int(os.getenv("DB_TRACE_REPEAT", "3"))           # повторов за апдейт = N+1
+DB_TRACE_DUMP = os.getenv("DB_TRACE_DUMP", "db_trace.json")
+# Group commit заявок: одновременные add_request пишутся одной пачкой (group_commit.py)
+REQUEST_BATCHING = os.getenv("REQUEST_BATCHING", "0") == "1"
+REQUEST_BATCH_MAX_SIZE = int(os.getenv("REQUEST_BATCH_MAX_SIZE", "50"))
+REQUEST_BATCH_MAX_WAIT_MS = float(os.getenv("REQUEST_BATCH_MAX_WAIT_MS", "5"))
+REQUEST_BATCH_MAX_INFLIGHT = int(os.getenv("REQUEST_BATCH_MAX_INFLIGHT", "1"))  # пачек одновременно
+
+# FSM storage: "memory" (один процесс) или "postgres" (несколько реплик)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory").lower()
+FSM_TTL = float(os.getenv("FSM_TTL", "86400"))  # брошенные сценарии живут сутки
+
+# Telegram rate limits
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))      # сообщений/сек на бота
+TG_PER_CHAT_RATE = float(os.getenv("TG_PER_CHAT_RATE", "1"))   # сообщений/сек в один чат
+TG_SEND_RETRIES = int(os.getenv("TG_SEND_RETRIES", "3"))
+
+# Лимиты заявок из web app (SubmissionLimitMiddleware, throttling.py)
+SUBMIT_USER_PER_MINUTE = float(os.getenv("SUBMIT_USER_PER_MINUTE", "3"))
+SUBMIT_USER_BURST = float(os.getenv("SUBMIT_USER_BURST", "3"))
+SUBMIT_SERVICE_PER_MINUTE = float(os.getenv("SUBMIT_SERVICE_PER_MINUTE", "60"))
+SUBMIT_SERVICE_BURST = float(os.getenv("SUBMIT_SERVICE_BURST", "20"))
+SUBMIT_MAX_INFLIGHT = int(os.getenv("SUBMIT_MAX_INFLIGHT", "50"))            # заявок в обработке
+SUBMIT_SHED_POOL_WAITERS = int(os.getenv("SUBMIT_SHED_POOL_WAITERS", "10"))  # очередь к пулу БД
+
+# Кеш ролей (user -> сервисы, где он админ)
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", "50000"))
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", "300"))
+
+# Кеш свежих заявок (клиент и сервис) для колбэков смены статуса
+REQUEST_CACHE_SIZE = int(os.getenv("REQUEST_CACHE_SIZE", "10000"))
+REQUEST_CACHE_TTL = float(os.getenv("REQUEST_CACHE_TTL", "86400"))
+
+# Кеш поиска сервисов по городу в api.py
+CITY_CACHE_SIZE = int(os.getenv("CITY_CACHE_SIZE", "2000"))
+CITY_CACHE_TTL = float(os.getenv("CITY_CACHE_TTL", "600"))
+SERVICE_CACHE_SIZE = int(os.getenv("SERVICE_CACHE_SIZE", "10000"))
+SERVICE_CACHE_TTL = float(os.getenv("SERVICE_CACHE_TTL", "3600"))
+
+# Подсказки /api/autocomplete
+AUTOCOMPLETE_LIMIT = int(os.getenv("AUTOCOMPLETE_LIMIT", "8"))
+AUTOCOMPLETE_CACHE_SIZE = int(os.getenv("AUTOCOMPLETE_CACHE_SIZE", "5000"))
+AUTOCOMPLETE_CACHE_TTL = float(os.getenv("AUTOCOMPLETE_CACHE_TTL", "60"))
+SEARCH_SIMILARITY = float(os.getenv("SEARCH_SIMILARITY", "0.5"))  # порог word_similarity pg_trgm
+
+# Поиск ближайших сервисов (/api/services/nearby)
+GEO_CELL_DEG = float(os.getenv("GEO_CELL_DEG", "0.05"))        # шаг сетки, ~5.5 км по широте
+GEO_MAX_RADIUS_KM = float(os.getenv("GEO_MAX_RADIUS_KM", "100"))
+
+# HTTP Cache-Control max-age (сек) для ответов API
+HTTP_MAX_AGE_SERVICE = int(os.getenv("HTTP_MAX_AGE_SERVICE", "300"))
+HTTP_MAX_AGE_CITY = int(os.getenv("HTTP_MAX_AGE_CITY", "60"))
+
+# Outbox (очередь исходящих уведомлений)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+
+# Выгрузка заявок (/export, /api/service/{id}/export)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))        # строк за fetch курсора
+EXPORT_AUTH_MAX_AGE = float(os.getenv("EXPORT_AUTH_MAX_AGE", "86400"))  # свежесть initData, сек
+EXPORT_MAX_DOCUMENT_MB = float(os.getenv("EXPORT_MAX_DOCUMENT_MB", "50"))  # лимит Bot API на файл
+
+# Логирование: json | text; LOG_CHATTER_LEVEL — для построчных логов апдейтов,
+# LOG_SAMPLE_RATE — доля апдейтов (0..1), чьи INFO-строки попадают в лог
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_CHATTER_LEVEL = os.getenv("LOG_CHATTER_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+
+# Prometheus-метрики: api.py отдаёт /metrics сам, бот в polling-режиме — на отдельном порту
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "9101"))
 
 # Service names
 SERVICE_NAMES = {
@@ -37,6 +124,17 @@ URGENCY_NAMES = {
     "urgent": "Очень срочный (сегодня)"
 }
 
+NEW_STATUS_LABEL = "🆕 Новая"
+
+# Фильтры браузера заявок: ключ -> подпись кнопки ("all" — без фильтра)
+REQUEST_FILTERS = {
+    "all": "Все",
+    "new": "🆕",
+    "accepted": "✅",
+    "called": "📞",
+    "rejected": "❌"
+}
+
 STATUS_LABELS = {
     "accepted": "✅ Принято",
     "called": "📞 Связались",
@@ -1,34 +1,189 @@
+import asyncio
 import asyncpg
-from config import PG_USER, PG_PASSWORD, PG_HOST, PG_PORT, PG_DB, BOT_USERNAME
+import json
+import logging
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+from config import (
+    PG_USER, PG_PASSWORD, PG_HOST, PG_PORT, PG_DB, BOT_USERNAME,
+    ROLE_CACHE_SIZE, ROLE_CACHE_TTL, REQUEST_CACHE_SIZE, REQUEST_CACHE_TTL,
+    DB_AUTO_MIGRATE, EXPORT_BATCH_SIZE, SEARCH_SIMILARITY, DB_TRACE, DB_TRACE_SLOW_MS, DB_TRACE_REPEAT, DB_TRACE_DUMP,
+    REQUEST_BATCHING, REQUEST_BATCH_MAX_SIZE, REQUEST_BATCH_MAX_WAIT_MS,
+    REQUEST_BATCH_MAX_INFLIGHT
+)
+from cache import TTLCache
+from tracing import QueryTracer
+from group_commit import GroupCommitWriter
+from export import EXPORT_COLUMNS
+from migrations import migrate
 from uuid import uuid4
 
+logger = logging.getLogger(__name__)
+
+@dataclass
+class OutboxMessage:
+    """Исходящее сообщение, которое отправит воркер outbox"""
+    kind: str
+    chat_id: int
+    text: str
+    reply_markup: Any = None
+
+    def as_row(self):
+        markup = self.reply_markup
+        if markup is not None and not isinstance(markup, str):
+            markup = markup.model_dump_json(exclude_none=True)
+        return self.kind, self.chat_id, self.text, markup
+
+@dataclass
+class SavedRequest:
+    """Новая заявка и активные админы её сервиса на момент сохранения"""
+    idrequest: str
+    admins: list
+
+
+# admins -> уведомления о новой заявке (Database.add_request)
+OutboxBuilder = Callable[[list], list[OutboxMessage]]
+
 class Database:
     def __init__(self):
         self.pool = None
+        self._listeners = []
+        self._relisten_tasks: set[asyncio.Task] = set()
+        # user_id -> активные сервисы админа; пустой кортеж = «не админ».
+        # Сбрасывается локально и во всех процессах по NOTIFY roles_changed (watch_roles)
+        self.role_cache = TTLCache(maxsize=ROLE_CACHE_SIZE, ttl=ROLE_CACHE_TTL)
+        # idrequest -> клиент и сервис свежей заявки (см. cache_request)
+        self.request_cache = TTLCache(maxsize=REQUEST_CACHE_SIZE, ttl=REQUEST_CACHE_TTL)
+        self.tracer = QueryTracer(self, DB_TRACE_SLOW_MS, DB_TRACE_REPEAT) if DB_TRACE else None
+        self.request_writer = GroupCommitWriter(
+            self._insert_requests_batch, REQUEST_BATCH_MAX_SIZE,
+            REQUEST_BATCH_MAX_WAIT_MS / 1000, REQUEST_BATCH_MAX_INFLIGHT
+        ) if REQUEST_BATCHING else None
 
-    async def connect(self):
+    async def connect(self, run_migrations: bool = DB_AUTO_MIGRATE):
         self.pool = await asyncpg.create_pool(
             user=PG_USER, password=PG_PASSWORD, database=PG_DB,
-            host=PG_HOST, port=PG_PORT, min_size=5, max_size=20
+            host=PG_HOST, port=PG_PORT, min_size=5, max_size=20,
+            init=self._init_connection,
+            server_settings={"pg_trgm.word_similarity_threshold": str(SEARCH_SIMILARITY)}
         )
-        print("✅ БД подключена")
+        if run_migrations:
+            applied = await migrate(self.pool)
+            if applied:
+                logger.info(f"🛠 Применены миграции: {applied}")
+        logger.info("✅ БД подключена")
+
+    async def _init_connection(self, conn):
+        if self.tracer:
+            conn.add_query_logger(self.tracer.on_query)
 
     async def close(self):
+        if self.request_writer:
+            await self.request_writer.close()
+        if self.tracer:
+            self.tracer.dump(DB_TRACE_DUMP)
         if self.pool:
+            for task in self._relisten_tasks:
+                task.cancel()
+            for conn, channel, callback, _ in self._listeners:
+                conn.remove_termination_listener(self._on_listener_lost)
+                await conn.remove_listener(channel, callback)
+                await self.pool.release(conn)
+            self._listeners.clear()
             await self.pool.close()
-            print("❌ БД отключена")
+            logger.info("❌ БД отключена")
+
+    def pool_waiters(self) -> int:
+        """Сколько корутин ждут соединение из пула (публичного счётчика у asyncpg нет)"""
+        queue = getattr(self.pool, "_queue", None)
+        return len(getattr(queue, "_getters", ()) or ())
+
+    async def listen(self, channel: str, callback,
+                     on_reconnect: Optional[Callable[[], Awaitable[None]]] = None):
+        """
+        Подписаться на NOTIFY channel.
+        Под подписку выделяется отдельное соединение из пула до close().
+        Оборванное соединение заменяется новым с той же подпиской, после чего
+        вызывается on_reconnect(): уведомления за время обрыва потеряны,
+        и то, что по ним сбрасывалось, надо пересобрать.
+        """
+        conn = await self.pool.acquire()
+        await conn.add_listener(channel, callback)
+        conn.add_termination_listener(self._on_listener_lost)
+        self._listeners.append((conn, channel, callback, on_reconnect))
+
+    def _on_listener_lost(self, conn):
+        for i, (listener_conn, channel, callback, on_reconnect) in enumerate(self._listeners):
+            if listener_conn is conn:
+                del self._listeners[i]
+                logger.error("❌ Соединение LISTEN %s оборвалось, переподключаюсь", channel)
+                task = asyncio.create_task(self._relisten(channel, callback, on_reconnect))
+                self._relisten_tasks.add(task)
+                task.add_done_callback(self._relisten_tasks.discard)
+                return
+
+    async def _relisten(self, channel: str, callback, on_reconnect):
+        # Мёртвое соединение пул освобождает сам
+        delay = 1
+        while not self.pool.is_closing():
+            try:
+                await self.listen(channel, callback, on_reconnect)
+                break
+            except Exception as e:
+                logger.warning("⚠️ LISTEN %s не восстановлен (%s), повтор через %s с",
+                               channel, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+        else:
+            return
+        logger.info("✅ LISTEN %s восстановлен", channel)
+        if on_reconnect:
+            try:
+                await on_reconnect()
+            except Exception as e:
+                logger.error("❌ Пересборка после переподключения LISTEN %s: %s", channel, e,
+                             exc_info=True)
+
+    async def watch_roles(self):
+        """
+        Сбрасывать role_cache по изменениям admins из других процессов (триггер,
+        миграция 11). Пока подписка восстанавливалась, изменения могли пройти
+        мимо — тогда кеш очищается целиком
+        """
+        await self.listen("roles_changed", self._on_roles_changed, on_reconnect=self._on_roles_relisten)
+
+    def _on_roles_changed(self, conn, pid, channel, payload):
+        self.role_cache.invalidate(int(payload))
+
+    async def _on_roles_relisten(self):
+        self.role_cache.clear()
 
     # ===== СЕРВИСЫ =====
     async def add_service(self, service_name: str, phone: str, owner_id: int,
-                          location: str = "", city: str = "") -> str:
+                          location: str = "", city: str = "",
+                          lat: Optional[float] = None, lon: Optional[float] = None) -> str:
         idservice = str(uuid4())
         async with self.pool.acquire() as conn:
+            # NOTIFY services_changed сбрасывает кеш городов в api.py,
+            # services_geo (если есть координаты) добавляет сервис в гео-индекс
             await conn.execute(
-                """INSERT INTO services (idservice, service_name, service_number, owner_id,
-                   location_service, city) VALUES ($1, $2, $3, $4, $5, $6)""",
+                """WITH ins AS (
+                       INSERT INTO services (idservice, service_name, service_number, owner_id,
+                       location_service, city, lat, lon) VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                       RETURNING idservice, service_name, service_number, location_service,
+                                 city, lat, lon
+                   ),
+                   geo AS (
+                       SELECT pg_notify('services_geo', row_to_json(ins)::text)
+                       FROM ins WHERE lat IS NOT NULL
+                   )
+                   SELECT pg_notify('services_changed', city), (SELECT count(*) FROM geo)
+                   FROM ins""",
                 idservice, service_name.strip(), phone.strip(),
-                owner_id, location.strip(), city.strip()
+                owner_id, location.strip(), city.strip(), lat, lon
             )
+        self.role_cache.invalidate(owner_id)
         return idservice
 
     async def get_service_by_owner(self, owner_id: int):
@@ -40,11 +195,18 @@ class Database:
     async def get_service_by_id(self, idservice: str):
         async with self.pool.acquire() as conn:
             return await conn.fetchrow(
-                """SELECT idservice, service_name, service_number, location_service, city
+                """SELECT idservice, service_name, service_number, location_service, city, updated_at
                    FROM services WHERE idservice = $1""",
                 idservice
             )
 
+    async def get_service_version(self, idservice: str):
+        """updated_at сервиса (или None) — проба первичного ключа для ETag в api.py"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                "SELECT updated_at FROM services WHERE idservice = $1", idservice
+            )
+
     def generate_service_link(self, idservice: str) -> str:
         return f"https://t.me/{BOT_USERNAME.strip()}?start=SVC_{idservice}"
 
@@ -70,33 +232,25 @@ class Database:
         return message
 
     # ===== АДМИНИСТРАТОРЫ =====
-    async def add_admin(self, idservice: str, idusertg: int):
+    async def add_admin(self, idservice: str, idusertg: int) -> str:
         """
-        Добавить администратора.
-        Если запись уже существует (даже с idrecstatus=-1) — восстанавливаем её.
-        Если нет — создаём новую.
+        Добавить администратора одним upsert'ом.
+        Возвращает "created" (новая запись), "reactivated" (была удалена,
+        idrecstatus=-1 → 0) или "active" (уже был активным администратором).
         """
         async with self.pool.acquire() as conn:
-            existing = await conn.fetchrow(
-                "SELECT idadmins FROM admins WHERE idservice = $1 AND idusertg = $2",
-                idservice, idusertg
+            row = await conn.fetchrow(
+                """INSERT INTO admins (idadmins, idservice, idusertg, idrecstatus)
+                   VALUES ($1, $2, $3, 0)
+                   ON CONFLICT (idservice, idusertg)
+                   DO UPDATE SET idrecstatus = 0 WHERE admins.idrecstatus <> 0
+                   RETURNING (xmax = 0) AS inserted""",
+                str(uuid4()), idservice, idusertg
             )
-            if existing:
-                # Запись есть — просто активируем
-                await conn.execute(
-                    "UPDATE admins SET idrecstatus = 0 WHERE idservice = $1 AND idusertg = $2",
-                    idservice, idusertg
-                )
-                return existing['idadmins']
-            else:
-                # Новая запись
-                idadmin = str(uuid4())
-                await conn.execute(
-                    """INSERT INTO admins (idadmins, idservice, idusertg, idrecstatus)
-                       VALUES ($1, $2, $3, 0)""",
-                    idadmin, idservice, idusertg
-                )
-                return idadmin
+        self.role_cache.invalidate(idusertg)
+        if row is None:
+            return "active"
+        return "created" if row['inserted'] else "reactivated"
 
     async def remove_admin(self, idservice: str, idusertg: int):
         """Мягкое удаление: idrecstatus = -1"""
@@ -105,17 +259,23 @@ class Database:
                 "UPDATE admins SET idrecstatus = -1 WHERE idservice = $1 AND idusertg = $2",
                 idservice, idusertg
             )
+        self.role_cache.invalidate(idusertg)
 
     async def get_admin_services(self, admin_id: int) -> list:
-        """Только активные сервисы (idrecstatus = 0)"""
+        """Только активные сервисы (idrecstatus = 0). Результат кешируется в role_cache"""
+        cached = self.role_cache.get(admin_id)
+        if cached is not None:
+            return list(cached)
         async with self.pool.acquire() as conn:
-            return await conn.fetch(
+            services = await conn.fetch(
                 """SELECT s.idservice, s.service_name, s.service_number, s.location_service
                    FROM services s
                    JOIN admins a ON s.idservice = a.idservice
                    WHERE a.idusertg = $1 AND a.idrecstatus = 0""",
                 admin_id
             )
+        self.role_cache.set(admin_id, tuple(services))
+        return services
 
     async def get_owned_services(self, owner_id: int) -> list:
         async with self.pool.acquire() as conn:
@@ -129,8 +289,9 @@ class Database:
         """Только активные администраторы (idrecstatus = 0)"""
         async with self.pool.acquire() as conn:
             return await conn.fetch(
-                """SELECT a.idadmins, a.idservice, a.idusertg
+                """SELECT a.idadmins, a.idservice, a.idusertg, s.service_name
                    FROM admins a
+                   JOIN services s ON s.idservice = a.idservice
                    WHERE a.idservice = $1 AND a.idrecstatus = 0""",
                 service_id
             )
@@ -148,17 +309,110 @@ class Database:
     # ===== ЗАЯВКИ =====
     async def add_request(self, idservice: str, client_name: str, phone: str,
                           brand: str, model: str, plate: str, service_type: str,
-                          urgency: str, comment: str, client_tg_id: int) -> str:
-        idrequest = str(uuid4())
+                          urgency: str, comment: str, client_tg_id: int,
+                          idrequest: Optional[str] = None,
+                          notify: Optional[OutboxBuilder] = None,
+                          idempotency_key: Optional[str] = None) -> Optional[SavedRequest]:
+        """
+        Сохранить заявку и (в той же транзакции) уведомления о ней.
+        Сначала вставка: повтор с тем же idempotency_key от того же клиента стоит
+        одну пробу уникального индекса и возвращает None. Для новой заявки там же
+        читаются активные админы сервиса, и notify(admins) собирает уведомления.
+        При REQUEST_BATCHING одновременные вызовы пишутся одной пачкой (group_commit.py)
+        """
+        row = (idrequest or str(uuid4()), idservice, client_name, phone, brand, model, plate,
+               service_type, urgency, comment, client_tg_id, idempotency_key)
+        if self.request_writer:
+            return await self.request_writer.submit((row, notify))
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                """INSERT INTO requests (idrequests, idservice, client_name, phone, brand, model,
-                plate, service_type, urgency, comment, idclienttg, status)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, 'new')""",
-                idrequest, idservice, client_name, phone, brand, model, plate,
-                service_type, urgency, comment, client_tg_id
-            )
-        return idrequest
+            async with conn.transaction():
+                return await self._insert_request(conn, row, notify)
+
+    async def _service_admins(self, conn, idservices) -> dict[str, list]:
+        """Активные админы сервисов (с названием сервиса): idservice -> записи"""
+        idservices = [i for i in set(idservices) if i]
+        admins: dict[str, list] = {}
+        if not idservices:
+            return admins
+        for r in await conn.fetch(
+            """SELECT a.idadmins, a.idservice, a.idusertg, s.service_name
+               FROM admins a
+               JOIN services s ON s.idservice = a.idservice
+               WHERE a.idservice = ANY($1::text[]) AND a.idrecstatus = 0""",
+            idservices
+        ):
+            admins.setdefault(r['idservice'], []).append(r)
+        return admins
+
+    async def _insert_request(self, conn, row: tuple,
+                              notify: Optional[OutboxBuilder]) -> Optional[SavedRequest]:
+        inserted = await conn.fetchval(
+            """INSERT INTO requests (idrequests, idservice, client_name, phone, brand, model,
+            plate, service_type, urgency, comment, idclienttg, idempotency_key, status)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, 'new')
+            ON CONFLICT (idclienttg, idempotency_key) WHERE idempotency_key IS NOT NULL
+            DO NOTHING
+            RETURNING idrequests""",
+            *row
+        )
+        if inserted is None:
+            return None
+        admins = (await self._service_admins(conn, [row[1]])).get(row[1], [])
+        if notify:
+            await self._enqueue(conn, notify(admins))
+        return SavedRequest(inserted, admins)
+
+    async def _insert_requests_batch(self, items: list[tuple]) -> list[Optional[SavedRequest]]:
+        """
+        Пачка (row, notify) от GroupCommitWriter: все строки одним INSERT ... SELECT
+        FROM unnest (RETURNING нужен для дублей — executemany/COPY его не дают),
+        админы вставленных — одним запросом, уведомления — одним executemany,
+        всё в одной транзакции.
+        Если пачка упала, заявки пишутся по одной на том же соединении (точка
+        сохранения на каждую), чтобы чужая ошибка не валила остальные
+        """
+        rows = [row for row, _ in items]
+        async with self.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    inserted = {r['idrequests'] for r in await conn.fetch(
+                        """INSERT INTO requests (idrequests, idservice, client_name, phone, brand,
+                        model, plate, service_type, urgency, comment, idclienttg,
+                        idempotency_key, status)
+                        SELECT *, 'new' FROM unnest(
+                            $1::text[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[],
+                            $7::text[], $8::text[], $9::text[], $10::text[], $11::bigint[], $12::text[]
+                        )
+                        ON CONFLICT (idclienttg, idempotency_key) WHERE idempotency_key IS NOT NULL
+                        DO NOTHING
+                        RETURNING idrequests""",
+                        *(list(column) for column in zip(*rows))
+                    )}
+                    admins = await self._service_admins(
+                        conn, [row[1] for row in rows if row[0] in inserted]
+                    )
+                    await self._enqueue(conn, [
+                        message for row, notify in items if notify and row[0] in inserted
+                        for message in notify(admins.get(row[1], []))
+                    ])
+            except Exception as e:
+                if len(items) == 1:
+                    raise
+                logger.warning("⚠️ Пачка из %d заявок не записалась (%s), пишу по одной",
+                               len(items), e)
+                # На том же соединении, по точке сохранения на заявку: исключение
+                # конкретной заявки уйдёт её вызывающему, остальные запишутся
+                results = []
+                async with conn.transaction():
+                    for row, notify in items:
+                        try:
+                            async with conn.transaction():
+                                results.append(await self._insert_request(conn, row, notify))
+                        except Exception as row_error:
+                            results.append(row_error)
+                return results
+        return [SavedRequest(row[0], admins.get(row[1], [])) if row[0] in inserted else None
+                for row in rows]
 
     async def get_request(self, idrequest: str):
         async with self.pool.acquire() as conn:
@@ -166,11 +420,74 @@ class Database:
                 "SELECT * FROM requests WHERE idrequests = $1", idrequest
             )
 
-    async def update_request_status(self, idrequest: str, status: str):
+    async def update_request_status(self, idrequest: str, status: str,
+                                    outbox: Optional[list[OutboxMessage]] = None):
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE requests SET status = $1 WHERE idrequests = $2", status, idrequest
+            async with conn.transaction():
+                await conn.execute(
+                    "UPDATE requests SET status = $1 WHERE idrequests = $2", status, idrequest
+                )
+                await self._enqueue(conn, outbox)
+
+    async def transition_request_status(self, idrequest: str, status: str,
+                                        notify_text: Optional[str] = None):
+        """
+        Сменить статус заявки одним запросом.
+        Возвращает idclienttg, service_name, previous_status и changed
+        (False — статус уже был таким, клиент повторно не уведомляется)
+        или None, если заявки нет. Если передан notify_text и статус изменился,
+        уведомление клиенту ставится в outbox в том же запросе.
+        Название сервиса берётся из request_cache, если заявка там есть.
+        """
+        cached = self.request_cache.get(idrequest)
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """WITH prev AS (
+                       SELECT idrequests, idservice, idclienttg, status
+                       FROM requests WHERE idrequests = $1
+                       FOR UPDATE
+                   ), upd AS (
+                       UPDATE requests r SET status = $2
+                       FROM prev
+                       WHERE r.idrequests = prev.idrequests
+                         AND prev.status IS DISTINCT FROM $2
+                       RETURNING r.idrequests
+                   ), info AS (
+                       SELECT prev.*, COALESCE(
+                           $4::text,
+                           (SELECT s.service_name FROM services s WHERE s.idservice = prev.idservice)
+                       ) AS service_name
+                       FROM prev
+                   ), ins AS (
+                       INSERT INTO outbox (kind, chat_id, text)
+                       SELECT 'status_changed', info.idclienttg::bigint,
+                              format(E'%s\n\n<b>Сервис:</b> %s\n<b>Номер заявки:</b> <code>%s</code>',
+                                     $3::text, COALESCE(info.service_name, 'Автосервис'),
+                                     info.idrequests)
+                       FROM upd
+                       JOIN info ON info.idrequests = upd.idrequests
+                       WHERE $3::text IS NOT NULL AND info.idclienttg IS NOT NULL
+                       RETURNING id
+                   )
+                   SELECT info.idclienttg, info.idservice, info.service_name,
+                          info.status AS previous_status,
+                          EXISTS (SELECT 1 FROM upd) AS changed,
+                          (SELECT count(pg_notify('outbox', '')) FROM ins) AS queued
+                   FROM info""",
+                idrequest, status, notify_text, cached and cached['service_name']
             )
+        if row is not None:
+            self.cache_request(idrequest, row['idclienttg'], row['idservice'], row['service_name'])
+        return row
+
+    def cache_request(self, idrequest: str, client_id, idservice: str,
+                      service_name: Optional[str]):
+        """Запомнить клиента и название сервиса заявки для колбэков статуса"""
+        self.request_cache.set(idrequest, {
+            "client_id": client_id,
+            "service_id": idservice,
+            "service_name": service_name,
+        })
 
     async def get_service_requests(self, idservice: str) -> list:
         async with self.pool.acquire() as conn:
@@ -178,14 +495,314 @@ class Database:
                 "SELECT * FROM requests WHERE idservice = $1 ORDER BY createdate DESC", idservice
             )
 
-    async def get_services_by_city(self, city: str) -> list:
+    async def iter_service_requests(self, idservice: str, date_from: Optional[date] = None,
+                                    date_to: Optional[date] = None, status: Optional[str] = None,
+                                    batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[list]:
+        """
+        Все заявки сервиса для выгрузки, от старых к новым, пачками по batch_size.
+        Серверный курсор в read-only транзакции: в памяти одна пачка. Соединение
+        занято, пока генератор не дочитан или не закрыт — потребитель не должен
+        надолго задерживаться между пачками. date_to включительно.
+        """
+        args = [idservice]
+        filters = ""
+        if date_from:
+            args.append(date_from)
+            filters += f" AND createdate >= ${len(args)}::date"
+        if date_to:
+            args.append(date_to)
+            filters += f" AND createdate < ${len(args)}::date + 1"
+        if status:
+            args.append(status)
+            filters += f" AND status = ${len(args)}"
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(
+                    f"""SELECT {", ".join(EXPORT_COLUMNS)}
+                        FROM requests
+                        WHERE idservice = $1{filters}
+                        ORDER BY createdate, idrequests""",
+                    *args
+                )
+                while rows := await cursor.fetch(batch_size):
+                    yield rows
+
+    async def get_admin_recent_requests(self, admin_id: int, per_service: int = 5) -> list:
+        """
+        Последние per_service заявок по каждому активному сервису админа — одним запросом.
+        Для сервиса без заявок возвращается одна строка с client_name = NULL.
+        """
         async with self.pool.acquire() as conn:
             return await conn.fetch(
-                """SELECT idservice, service_name, service_number, location_service, city
+                """SELECT s.idservice, s.service_name, r.client_name, r.status
+                   FROM services s
+                   JOIN admins a ON s.idservice = a.idservice
+                   LEFT JOIN LATERAL (
+                       SELECT client_name, status, createdate
+                       FROM requests
+                       WHERE idservice = s.idservice
+                       ORDER BY createdate DESC
+                       LIMIT $2
+                   ) r ON TRUE
+                   WHERE a.idusertg = $1 AND a.idrecstatus = 0
+                   ORDER BY s.service_name, s.idservice, r.createdate DESC""",
+                admin_id, per_service
+            )
+
+    async def get_requests_page(self, admin_id: int, idservice: Optional[str] = None,
+                                cursor: Optional[str] = None, newer: bool = False,
+                                status: Optional[str] = None, limit: int = 10):
+        """
+        Страница заявок сервиса, keyset по (createdate, idrequests) — один индексный запрос.
+        Первая страница — по idservice; дальше — относительно cursor (idrequests крайней
+        заявки): newer=False — более старые, newer=True — более новые.
+        Возвращает (rows, has_more): rows от новых к старым, has_more — есть ли ещё
+        заявки в направлении листания. Видны только активному админу сервиса.
+        """
+        args = [admin_id]
+        if cursor:
+            args.append(cursor)
+            source = "requests r JOIN requests c ON c.idrequests = $2 AND r.idservice = c.idservice"
+            keyset = f"AND (r.createdate, r.idrequests) {'>' if newer else '<'} (c.createdate, c.idrequests)"
+        else:
+            args.append(idservice)
+            source = "requests r"
+            keyset = "AND r.idservice = $2"
+        status_filter = ""
+        if status:
+            args.append(status)
+            status_filter = f"AND r.status = ${len(args)}"
+        args.append(limit + 1)
+        order = "ASC" if newer else "DESC"
+
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                f"""SELECT r.idrequests, r.idservice, r.createdate, r.client_name,
+                           r.brand, r.model, r.status, s.service_name
+                    FROM {source}
+                    JOIN services s ON s.idservice = r.idservice
+                    WHERE EXISTS (
+                        SELECT 1 FROM admins a
+                        WHERE a.idservice = r.idservice AND a.idusertg = $1 AND a.idrecstatus = 0
+                    )
+                    {keyset}
+                    {status_filter}
+                    ORDER BY r.createdate {order}, r.idrequests {order}
+                    LIMIT ${len(args)}""",
+                *args
+            )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if newer:
+            rows.reverse()
+        return rows, has_more
+
+    async def get_service_stats(self, idservices: list[str], days: int = 14,
+                                owner_id: Optional[int] = None) -> list[dict]:
+        """
+        Аналитика сервисов из service_daily_stats (ведёт триггер, см. миграции 5 и 9) —
+        один индексный запрос. owner_id — показать только сервисы этого владельца.
+        Возвращает по сервису: счётчики по статусам, всего заявок, среднее время первой
+        реакции (сек или None) и daily — последние days дней, включая пустые.
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """SELECT s.idservice, s.service_name,
+                          COALESCE(sum(st.created), 0)  AS total,
+                          COALESCE(sum(st.d_new), 0)      AS new,
+                          COALESCE(sum(st.d_accepted), 0) AS accepted,
+                          COALESCE(sum(st.d_called), 0)   AS called,
+                          COALESCE(sum(st.d_rejected), 0) AS rejected,
+                          COALESCE(sum(st.responded), 0)  AS responded,
+                          COALESCE(sum(st.response_seconds), 0) AS response_seconds,
+                          COALESCE(jsonb_object_agg(
+                              st.day::text, jsonb_build_object(
+                                  'created', st.created, 'accepted', st.accepted,
+                                  'called', st.called, 'rejected', st.rejected)
+                          ) FILTER (WHERE st.day > current_date - $2::int), '{}') AS daily,
+                          current_date AS today
+                   FROM services s
+                   LEFT JOIN service_daily_stats st ON st.idservice = s.idservice
+                   WHERE s.idservice = ANY($1::text[])
+                     AND ($3::bigint IS NULL OR s.owner_id = $3)
+                   GROUP BY s.idservice, s.service_name
+                   ORDER BY s.service_name""",
+                idservices, days, owner_id
+            )
+        result = []
+        for r in rows:
+            daily = json.loads(r['daily'])
+            empty = {"created": 0, "accepted": 0, "called": 0, "rejected": 0}
+            result.append({
+                "idservice": r['idservice'],
+                "service_name": r['service_name'],
+                "total": r['total'],
+                "by_status": {k: r[k] for k in ("new", "accepted", "called", "rejected")},
+                "avg_response_seconds": (
+                    r['response_seconds'] / r['responded'] if r['responded'] else None
+                ),
+                "daily": [
+                    {"day": day.isoformat(), **daily.get(day.isoformat(), empty)}
+                    for day in (r['today'] - timedelta(days=i) for i in reversed(range(days)))
+                ],
+            })
+        return result
+
+    async def get_services_by_city(self, *cities: str) -> list:
+        """Сервисы города; cities — его написания («Королёв», «Королев»), см. CityPrefixIndex"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                """SELECT idservice, service_name, service_number, location_service, city, updated_at
                    FROM services
-                   WHERE LOWER(TRIM(city)) = LOWER(TRIM($1))
+                   WHERE LOWER(TRIM(city)) = ANY($1::text[])
                    ORDER BY service_name""",
-                city.strip()
+                [c.strip().lower() for c in cities]
+            )
+
+    async def get_city_version(self, *cities: str):
+        """(число сервисов, последнее изменение) города — версия для ETag в api.py"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                """SELECT count(*) AS services, max(updated_at) AS updated_at
+                   FROM services
+                   WHERE LOWER(TRIM(city)) = ANY($1::text[])""",
+                [c.strip().lower() for c in cities]
+            )
+        return row['services'], row['updated_at']
+
+    async def get_located_services(self) -> list:
+        """Сервисы с координатами — начальная загрузка гео-индекса api.py"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                """SELECT idservice, service_name, service_number, location_service, city, lat, lon
+                   FROM services WHERE lat IS NOT NULL"""
+            )
+
+    async def get_city_counts(self) -> list:
+        """Справочник городов для префиксного индекса api.py: (city, число сервисов)"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                """SELECT min(TRIM(city)) AS city, count(*) AS services
+                   FROM services
+                   WHERE TRIM(city) <> ''
+                   GROUP BY LOWER(TRIM(city))"""
             )
 
+    async def search_autocomplete(self, query: str, limit: int) -> list:
+        """
+        Нечёткие подсказки городов и сервисов одним запросом (pg_trgm, GIN-индексы
+        миграции 6). word_similarity: «моск» похоже на «Москва», «санкт петербург» —
+        на «Санкт-Петербург». Строки: kind ('city' | 'service'), label, idservice,
+        city, score — по убыванию score внутри kind.
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                """(SELECT 'city' AS kind, min(TRIM(city)) AS label, NULL AS idservice,
+                           NULL AS city, max(word_similarity($1, LOWER(city))) AS score
+                    FROM services
+                    WHERE $1 <% LOWER(city)
+                    GROUP BY LOWER(TRIM(city))
+                    ORDER BY score DESC, label
+                    LIMIT $2)
+                   UNION ALL
+                   (SELECT 'service', service_name, idservice, city,
+                           word_similarity($1, LOWER(service_name)) AS score
+                    FROM services
+                    WHERE $1 <% LOWER(service_name)
+                    ORDER BY score DESC, service_name
+                    LIMIT $2)""",
+                query.lower(), limit
+            )
+
+    # ===== WEBHOOK =====
+    async def claim_update(self, update_id: int) -> bool:
+        """True — апдейт обрабатываем мы; False — его уже взяла другая реплика"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                """INSERT INTO processed_updates (update_id) VALUES ($1)
+                   ON CONFLICT DO NOTHING RETURNING TRUE""",
+                update_id
+            ) is not None
+
+    async def purge_processed_updates(self, max_age_seconds: float) -> int:
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(
+                """DELETE FROM processed_updates
+                   WHERE created_at < now() - make_interval(secs => $1)""",
+                float(max_age_seconds)
+            )
+        return int(result.split()[-1])
+
+    # ===== OUTBOX =====
+    async def _enqueue(self, conn, outbox: Optional[list[OutboxMessage]]):
+        if not outbox:
+            return
+        await conn.executemany(
+            """INSERT INTO outbox (kind, chat_id, text, reply_markup)
+               VALUES ($1, $2, $3, $4)""",
+            [m.as_row() for m in outbox]
+        )
+        await conn.execute("NOTIFY outbox")
+
+    async def enqueue(self, *messages: OutboxMessage):
+        """Поставить сообщения в очередь на отправку"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await self._enqueue(conn, list(messages))
+
+    async def claim_outbox(self, limit: int, lease_seconds: float) -> list:
+        """
+        Забрать пачку готовых к отправке сообщений.
+        Строки «арендуются» на lease_seconds: если процесс упадёт,
+        не отметив их, они снова станут доступны (at-least-once).
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                """UPDATE outbox
+                   SET attempts = attempts + 1,
+                       next_attempt_at = now() + make_interval(secs => $2)
+                   WHERE id IN (
+                       SELECT id FROM outbox
+                       WHERE status = 'pending' AND next_attempt_at <= now()
+                       ORDER BY next_attempt_at, id
+                       LIMIT $1
+                       FOR UPDATE SKIP LOCKED
+                   )
+                   RETURNING id, kind, chat_id, text, reply_markup, attempts""",
+                limit, float(lease_seconds)
+            )
+
+    async def release_outbox(self, outbox_id: int):
+        """Вернуть арендованную, но не отправленную строку: попытка не засчитывается"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """UPDATE outbox SET attempts = attempts - 1, next_attempt_at = now()
+                   WHERE id = $1 AND status = 'pending'""",
+                outbox_id
+            )
+
+    async def complete_outbox(self, sent_ids: list[int], failures: list[tuple]):
+        """
+        Отметить результат отправки.
+        failures — список (id, error, retry_in_seconds | None); None = больше не пытаться.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if sent_ids:
+                    await conn.execute(
+                        """UPDATE outbox SET status = 'sent', sent_at = now(), last_error = NULL
+                           WHERE id = ANY($1::bigint[])""",
+                        sent_ids
+                    )
+                if failures:
+                    await conn.executemany(
+                        """UPDATE outbox
+                           SET last_error = $2,
+                               status = CASE WHEN $3::float8 IS NULL THEN 'dead' ELSE 'pending' END,
+                               next_attempt_at = now() + make_interval(secs => COALESCE($3::float8, 0))
+                           WHERE id = $1""",
+                        failures
+                    )
+
 db = Database()
@@ -0,0 +1,84 @@
+"""
+Выгрузка заявок сервиса в CSV / JSONL.
+
+Строки приходят пачками из серверного курсора (Database.iter_service_requests)
+и кодируются по пачке за раз — память не зависит от размера выгрузки.
+spool() пишет выгрузку во временный файл: курсор и соединение с БД
+освобождаются со скоростью диска, а не клиента. Используется эндпоинтом
+/api/service/{id}/export и командой /export бота.
+"""
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+from datetime import date
+from typing import AsyncIterator, Optional
+
+EXPORT_COLUMNS = (
+    "idrequests", "createdate", "status", "client_name", "phone", "brand", "model",
+    "plate", "service_type", "urgency", "comment", "idclienttg"
+)
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """YYYY-MM-DD или None; ValueError на мусор"""
+    return date.fromisoformat(value) if value else None
+
+
+def export_filename(idservice: str, fmt: str) -> str:
+    return f"requests_{idservice[:8]}_{date.today().isoformat()}.{fmt}"
+
+
+# Телефоны и числа со знаком — единственное, что можно оставить с «+»/«-» в начале
+_PLAIN_NUMBER_RE = re.compile(r"[+-]?[\d\s()-]+")
+
+
+def _csv_cell(value):
+    # Данные вводят клиенты: не даём табличным редакторам принять ячейку за формулу
+    if (isinstance(value, str) and value and value[0] in "=+-@\t\r"
+            and not _PLAIN_NUMBER_RE.fullmatch(value)):
+        return "'" + value
+    return value
+
+
+async def encode(batches: AsyncIterator[list], fmt: str) -> AsyncIterator[bytes]:
+    """Пачки записей asyncpg -> куски байтов в формате fmt (csv | jsonl)"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM — чтобы Excel открыл кириллицу без выбора кодировки
+        buffer.write("\ufeff")
+        writer.writerow(EXPORT_COLUMNS)
+        async for rows in batches:
+            writer.writerows([_csv_cell(r[c]) for c in EXPORT_COLUMNS] for r in rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    else:
+        async for rows in batches:
+            yield "".join(
+                json.dumps({c: r[c] for c in EXPORT_COLUMNS}, ensure_ascii=False, default=str) + "\n"
+                for r in rows
+            ).encode()
+
+
+async def spool(batches: AsyncIterator[list], fmt: str) -> tuple[str, int]:
+    """Выгрузка целиком во временный файл: (путь, размер в байтах). Файл удаляет вызывающий"""
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in encode(batches, fmt):
+                await asyncio.to_thread(f.write, chunk)
+            return path, f.tell()
+    except BaseException:
+        os.unlink(path)
+        raise
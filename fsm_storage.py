@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+_KEY_COLUMNS = "bot_id, chat_id, user_id, thread_id, business_connection_id, destiny"
+_KEY_WHERE = (
+    "bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 "
+    "AND business_connection_id = $5 AND destiny = $6"
+)
+# Строка «протухла»: брошенный сценарий, состояние и данные считаются пустыми
+_EXPIRED = "fsm_storage.updated_at < now() - make_interval(secs => $8)"
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в Postgres поверх общего пула Database.
+    Каждая операция — один запрос; записи старше ttl считаются
+    пустыми и периодически удаляются.
+    """
+
+    def __init__(self, database: Database, ttl: float, cleanup_interval: float = 3600):
+        self.db = database
+        self.ttl = float(ttl)
+        self.cleanup_interval = cleanup_interval
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    async def setup(self):
+        """Запустить очистку (после db.connect(); таблица создаётся миграцией)"""
+        self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    @staticmethod
+    def _key_args(key: StorageKey) -> tuple:
+        return (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id or 0,
+            key.business_connection_id or "", key.destiny,
+        )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        async with self.db.pool.acquire() as conn:
+            await conn.execute(
+                f"""INSERT INTO fsm_storage ({_KEY_COLUMNS}, state)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    ON CONFLICT ({_KEY_COLUMNS}) DO UPDATE
+                    SET state = EXCLUDED.state,
+                        data = CASE WHEN {_EXPIRED} THEN '{{}}'::jsonb ELSE fsm_storage.data END,
+                        updated_at = now()""",
+                *self._key_args(key), state, self.ttl
+            )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with self.db.pool.acquire() as conn:
+            return await conn.fetchval(
+                f"""SELECT state FROM fsm_storage
+                    WHERE {_KEY_WHERE}
+                      AND updated_at >= now() - make_interval(secs => $7)""",
+                *self._key_args(key), self.ttl
+            )
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        async with self.db.pool.acquire() as conn:
+            await conn.execute(
+                f"""INSERT INTO fsm_storage ({_KEY_COLUMNS}, data)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb)
+                    ON CONFLICT ({_KEY_COLUMNS}) DO UPDATE
+                    SET data = EXCLUDED.data,
+                        state = CASE WHEN {_EXPIRED} THEN NULL ELSE fsm_storage.state END,
+                        updated_at = now()""",
+                *self._key_args(key), json.dumps(data), self.ttl
+            )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with self.db.pool.acquire() as conn:
+            data = await conn.fetchval(
+                f"""SELECT data FROM fsm_storage
+                    WHERE {_KEY_WHERE}
+                      AND updated_at >= now() - make_interval(secs => $7)""",
+                *self._key_args(key), self.ttl
+            )
+        return json.loads(data) if data else {}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Слияние data || новое прямо в Postgres — один запрос вместо get + set"""
+        async with self.db.pool.acquire() as conn:
+            merged = await conn.fetchval(
+                f"""INSERT INTO fsm_storage ({_KEY_COLUMNS}, data)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb)
+                    ON CONFLICT ({_KEY_COLUMNS}) DO UPDATE
+                    SET data = CASE WHEN {_EXPIRED} THEN '{{}}'::jsonb
+                                    ELSE fsm_storage.data END || EXCLUDED.data,
+                        state = CASE WHEN {_EXPIRED} THEN NULL ELSE fsm_storage.state END,
+                        updated_at = now()
+                    RETURNING data""",
+                *self._key_args(key), json.dumps(data), self.ttl
+            )
+        return json.loads(merged)
+
+    async def purge_expired(self) -> int:
+        async with self.db.pool.acquire() as conn:
+            result = await conn.execute(
+                "DELETE FROM fsm_storage WHERE updated_at < now() - make_interval(secs => $1)",
+                self.ttl
+            )
+        return int(result.split()[-1])
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                removed = await self.purge_expired()
+                if removed:
+                    logger.info(f"🧹 Удалено брошенных FSM-сценариев: {removed}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки FSM: {e}")
+            await asyncio.sleep(self.cleanup_interval)
+
+    async def close(self) -> None:
+        # Пул общий с Database — закрывается в on_shutdown, здесь только фоновая очистка
+        if self._cleanup_task:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
@@ -0,0 +1,133 @@
+"""
+Пространственный индекс сервисов в памяти api.py для /api/services/nearby.
+
+Сетка по широте/долготе с шагом cell_deg (как geohash фиксированной точности):
+точка лежит в одной ячейке, k ближайших ищутся в окне вокруг запроса, которое
+растёт на шаг сетки в км, пока всё вне окна гарантированно не дальше найденного
+k-го (или max_km). Ширина окна в столбцах зависит от широты и у полюсов
+ограничена всей окружностью, так что число шагов не больше max_km / шаг.
+Расстояния считаются здесь (haversine), в SQL — ничего. Индекс грузится при
+старте и пополняется по NOTIFY services_geo (Database.add_service).
+"""
+import heapq
+import itertools
+import math
+from typing import Optional
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def valid_coordinates(lat: float, lon: float) -> bool:
+    return -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+class GeoGrid:
+    def __init__(self, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        self.columns = max(1, round(360 / cell_deg))
+        self._all_columns = set(range(self.columns))
+        self.first_row, self.last_row = math.floor(-90 / cell_deg), math.floor(90 / cell_deg)
+        self._cells: dict[tuple[int, int], set[str]] = {}
+        # idservice -> (lat, lon, ячейка, данные для ответа)
+        self._points: dict[str, tuple[float, float, tuple[int, int], dict]] = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def clear(self):
+        self._cells.clear()
+        self._points.clear()
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor((lon + 180) / self.cell_deg) % self.columns
+
+    def upsert(self, key: str, lat: float, lon: float, data: dict):
+        self.remove(key)
+        cell = self._cell(lat, lon)
+        self._cells.setdefault(cell, set()).add(key)
+        self._points[key] = (lat, lon, cell, data)
+
+    def remove(self, key: str):
+        point = self._points.pop(key, None)
+        if point:
+            members = self._cells[point[2]]
+            members.discard(key)
+            if not members:
+                del self._cells[point[2]]
+
+    def _half_width(self, lat: float, radius_km: float, rows: int) -> int:
+        """
+        Сколько столбцов в каждую сторону от ячейки запроса покрывают radius_km
+        во всех строках окна ±rows: при |широте| ≤ L sin(d/2) ≥ cos L · sin(Δlon/2)
+        """
+        edge_lat = abs(lat) + (rows + 1) * self.cell_deg
+        if edge_lat >= 90:
+            return self.columns
+        ratio = math.sin(radius_km / (2 * EARTH_RADIUS_KM)) / math.cos(math.radians(edge_lat))
+        if ratio >= 1:
+            return self.columns
+        return math.ceil(math.degrees(2 * math.asin(ratio)) / self.cell_deg)
+
+    def _columns(self, cj: int, half: int) -> set[int]:
+        if 2 * half + 1 >= self.columns:
+            return self._all_columns
+        return {(cj + dj) % self.columns for dj in range(-half, half + 1)}
+
+    def nearest(self, lat: float, lon: float, k: int,
+                max_km: Optional[float] = None) -> list[tuple[float, dict]]:
+        """До k ближайших точек: [(расстояние км, данные)] по возрастанию расстояния"""
+        if not self._points or k <= 0:
+            return []
+        ci, cj = self._cell(lat, lon)
+        step_km = self.cell_deg * KM_PER_DEGREE
+        best: list[tuple[float, str]] = []   # max-heap по расстоянию через отрицание
+        scanned_columns: set[int] = set()
+        # Окно растёт на step_km за шаг: строки ci±s, а столбцов столько, сколько
+        # нужно на этой широте для того же радиуса (у полюса — вся окружность).
+        # Всё вне окна шага s дальше bound = s·step_km
+        for s in itertools.count():
+            bound = s * step_km
+            columns = self._columns(cj, self._half_width(lat, bound, s))
+            edge_rows = {i for i in (ci - s, ci + s) if self.first_row <= i <= self.last_row}
+            inner_rows = range(max(ci - s + 1, self.first_row), min(ci + s - 1, self.last_row) + 1)
+            new_columns = columns - scanned_columns
+            for key in self._keys_in(edge_rows, columns, inner_rows, new_columns):
+                p_lat, p_lon, _, _ = self._points[key]
+                d = haversine_km(lat, lon, p_lat, p_lon)
+                if max_km is not None and d > max_km:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-d, key))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, key))
+            scanned_columns = columns
+            if len(best) == k and bound >= -best[0][0]:
+                break
+            if max_km is not None and bound > max_km:
+                break
+            if (ci - s <= self.first_row and ci + s >= self.last_row
+                    and len(columns) == self.columns):
+                break
+        return [(d, self._points[key][3]) for d, key in sorted((-nd, key) for nd, key in best)]
+
+    def _keys_in(self, edge_rows, columns, inner_rows, new_columns):
+        """Точки в новых ячейках шага: крайние строки целиком, внутренние — новые столбцы"""
+        size = len(edge_rows) * len(columns) + len(inner_rows) * len(new_columns)
+        if size > len(self._cells):
+            # Окно шире занятых ячеек (полярные широты): проще пройти по занятым
+            cells = [cell for cell in self._cells
+                     if (cell[0] in edge_rows and cell[1] in columns)
+                     or (cell[0] in inner_rows and cell[1] in new_columns)]
+        else:
+            cells = [(i, j) for i in edge_rows for j in columns]
+            cells += [(i, j) for i in inner_rows for j in new_columns]
+        for cell in cells:
+            yield from self._cells.get(cell, ())
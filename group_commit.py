@@ -0,0 +1,77 @@
+"""
+Group commit: одновременные записи копятся до max_batch штук или max_wait
+секунд и уходят в БД одной пачкой (одно соединение, одна транзакция).
+В полёте не больше max_inflight пачек: пока они коммитятся, следующая
+набирается и уходит, как только освободится место. Каждый вызывающий ждёт
+свой результат. Используется Database.add_request
+при REQUEST_BATCHING=1.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+
+class GroupCommitWriter:
+    def __init__(self, flush: Callable[[list], Awaitable[list]],
+                 max_batch: int, max_wait: float, max_inflight: int = 1):
+        """
+        flush(items) -> результаты в том же порядке. Исключение из flush получают
+        все вызывающие пачки, исключение-результат — только свой
+        """
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_inflight = max_inflight
+        self._inflight = 0
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush_pending)
+        # Отмена вызывающего не отменяет запись: пачка уже может быть в полёте
+        return await asyncio.shield(future)
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Без свободного места накопленное уйдёт, когда допишется текущая пачка (_write)
+        while self._pending and self._inflight < self.max_inflight:
+            batch = self._pending[:self.max_batch]
+            self._pending = self._pending[self.max_batch:]
+            self._inflight += 1
+            task = asyncio.create_task(self._write(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, batch: list):
+        try:
+            results = await self.flush([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._inflight -= 1
+            # Накопленное за время коммита уже прождало дольше max_wait
+            self._flush_pending()
+
+    async def close(self):
+        """Дописать накопленное и дождаться пачек в полёте"""
+        while self._pending or self._tasks:
+            self._flush_pending()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
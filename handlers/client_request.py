@@ -3,28 +3,42 @@ from aiogram.types import Message
 import json
 import logging
 from datetime import datetime
-from database import db
+from uuid import uuid4
+from database import db, OutboxMessage
 from keyboards import admin_keyboard
 from config import SERVICE_NAMES, URGENCY_NAMES, MASTER_CHAT_ID
+from log_config import request_id_var
+from cache import TTLCache
 
 logger = logging.getLogger(__name__)
 router = Router()
 
-# Временное хранилище д��я заявок (связь: request_id -> service_id)
-REQUESTS_CACHE = {}
+# (клиент, ключ идемпотентности) заявок, принятых этим процессом: двойное нажатие
+# отсекается без БД. Между репликами и после рестарта дубль ловит вставка в add_request
+# (уникальный индекс) — до выборки админов и сборки уведомлений
+recent_submissions = TTLCache(maxsize=10_000, ttl=600)
 
 @router.message(F.web_app_data)
 async def webapp_handler(message: Message):
     """Обработка данных из web app с service_id"""
-    logger.info("🔴 ВХОД В webapp_handler")
+    submission = None
     try:
-        logger.info(f"📨 Получены данные из web app")
         data = json.loads(message.web_app_data.data)
-        logger.info(f"✅ JSON распарсен: {data}")
-        
+
+        # Ключ из index.html: защита от двойного нажатия и повторной доставки
+        idempotency_key = str(data.get("idempotency_key") or "")[:64] or None
+        submission = (message.from_user.id, idempotency_key)
+        if idempotency_key:
+            if submission in recent_submissions:
+                logger.info("↩️ Повтор заявки (ключ %s) — пропускаю", idempotency_key)
+                submission = None  # не наш ключ — не сбрасывать его при ошибке
+                return
+            recent_submissions.set(submission, True)
+
         # Получаем service_id из данных web app
         service_id = data.get("service_id") or ""
-        logger.info(f"🔍 Service ID: '{service_id}'")
+        # Содержимое формы (имя, телефон) в лог не пишем
+        logger.info("📨 Заявка из web app, сервис '%s'", service_id)
         
         # Безопасно достаём данные
         name = data.get("client_name") or "Не указано"
@@ -39,30 +53,8 @@ async def webapp_handler(message: Message):
         service_name = SERVICE_NAMES.get(service_key, service_key or "—")
         urgency_name = URGENCY_NAMES.get(urgency_key, urgency_key or "—")
 
-        logger.info(f"📝 Данные заявки: {name}, {phone}, {brand}, {model}")
-
-        # ✅ СОХРАНЯЕМ В БД с service_id
-        request_id = await db.add_request(
-            idservice=service_id,
-            client_name=name,
-            phone=phone,
-            brand=brand,
-            model=model,
-            plate=plate,
-            service_type=service_key,
-            urgency=urgency_key,
-            comment=comment,
-            client_tg_id=message.from_user.id
-        )
-        logger.info(f"✅ Заявка сохранена в БД. Request ID: {request_id}")
-
-        # Кешируем для быстрого доступа
-        REQUESTS_CACHE[str(request_id)] = {
-            "user_id": message.from_user.id,
-            "name": name,
-            "phone": phone,
-            "service_id": service_id
-        }
+        request_id = str(uuid4())
+        request_id_var.set(request_id)
 
         # ✅ ФОРМИРУЕМ КРАСИВОЕ СООБЩЕНИЕ ДЛЯ АДМИНА
         admin_message = (
@@ -86,51 +78,53 @@ async def webapp_handler(message: Message):
         admin_message += f"\n⏰ {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
         admin_message += f"<b>ID заявки:</b> <code>{request_id}</code>"
 
-        # ✅ ПОЛУЧАЕМ ВСЕХ АДМИНОВ ЭТОГО СЕРВИСА И ОТПРАВЛЯЕМ ИМ ЗАЯВКУ
-        if service_id:
-            logger.info(f"🔎 Ищу админов для сервиса: '{service_id}'")
-            admins = await db.get_admins_by_service(service_id)
-            logger.info(f"📊 Найдено админов: {len(admins) if admins else 0}")
-            
+        # ✅ УВЕДОМЛЕНИЯ ВСЕМ АДМИНАМ СЕРВИСА — админов читает add_request
+        # в транзакции вставки, уже после проверки ключа: дубль до них не доходит
+        def build_outbox(admins: list) -> list[OutboxMessage]:
             if admins:
-                for admin in admins:
-                    try:
-                        admin_id = admin['idusertg']
-                        logger.info(f"📤 Отправляю заявку админу {admin_id}")
-                        await message.bot.send_message(  # ← ИСПОЛЬЗУЕМ message.bot
-                            admin_id,
-                            admin_message,
-                            parse_mode="HTML",
-                            reply_markup=admin_keyboard(request_id)
-                        )
-                        logger.info(f"✅ Заявка отправлена админу {admin_id}")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка отправки админу {admin['idusertg']}: {e}", exc_info=True)
+                return [
+                    OutboxMessage("new_request", admin['idusertg'], admin_message,
+                                  admin_keyboard(request_id))
+                    for admin in admins
+                ]
+            if service_id:
+                logger.warning("⚠️ Для сервиса '%s' нет админов", service_id)
             else:
-                logger.warning(f"⚠️ Для сервиса '{service_id}' нет админов")
-                if MASTER_CHAT_ID:
-                    logger.info(f"📤 Отправляю заявку в MASTER_CHAT: {MASTER_CHAT_ID}")
-                    try:
-                        await message.bot.send_message(  # ← ИСПОЛЬЗУЕМ message.bot
-                            MASTER_CHAT_ID,
-                            f"⚠️ <b>ЗАЯВКА БЕЗ СЕРВИСА</b>\n\n{admin_message}",
-                            parse_mode="HTML"
-                        )
-                        logger.info(f"✅ Заявка отправлена в MASTER_CHAT")
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка отправки в MASTER_CHAT: {e}", exc_info=True)
-        else:
-            logger.warning(f"⚠️ service_id не передан, отправляю в MASTER_CHAT")
+                logger.warning("⚠️ service_id не передан, отправляю в MASTER_CHAT")
             if MASTER_CHAT_ID:
-                try:
-                    await message.bot.send_message(  # ← ИСПОЛЬЗУЕМ message.bot
-                        MASTER_CHAT_ID,
-                        f"⚠️ <b>ЗАЯВКА БЕЗ СЕРВИСА</b>\n\n{admin_message}",
-                        parse_mode="HTML"
-                    )
-                    logger.info(f"✅ Заявка отправлена в MASTER_CHAT")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка отправки в MASTER_CHAT: {e}", exc_info=True)
+                return [OutboxMessage(
+                    "new_request", MASTER_CHAT_ID,
+                    f"⚠️ <b>ЗАЯВКА БЕЗ СЕРВИСА</b>\n\n{admin_message}"
+                )]
+            return []
+
+        # ✅ СОХРАНЯЕМ В БД с service_id (вместе с уведомлениями в outbox)
+        saved = await db.add_request(
+            idservice=service_id,
+            client_name=name,
+            phone=phone,
+            brand=brand,
+            model=model,
+            plate=plate,
+            service_type=service_key,
+            urgency=urgency_key,
+            comment=comment,
+            client_tg_id=message.from_user.id,
+            idrequest=request_id,
+            notify=build_outbox,
+            idempotency_key=idempotency_key
+        )
+        if saved is None:
+            # Первая копия уже сохранена и разослана, клиент получил подтверждение
+            logger.info("↩️ Повтор заявки (ключ %s) — пропускаю", idempotency_key)
+            return
+        logger.info("✅ Заявка сохранена, админов: %d", len(saved.admins))
+
+        # Кешируем клиента и сервис — колбэк смены статуса возьмёт их отсюда
+        db.cache_request(
+            request_id, message.from_user.id, service_id,
+            saved.admins[0]['service_name'] if saved.admins else None
+        )
 
         # ✅ ОТПРАВЛЯЕМ ПОДТВЕРЖДЕНИЕ КЛИЕНТУ
         await message.answer(
@@ -139,12 +133,14 @@ async def webapp_handler(message: Message):
             f"<b>Номер заявки:</b> <code>{request_id}</code>",
             parse_mode="HTML"
         )
-        logger.info(f"🟢 ВЫХОД ИЗ webapp_handler - ВСЕ ОК")
 
     except json.JSONDecodeError as e:
-        logger.error(f"❌ Ошибка при парсинге JSON: {e}", exc_info=True)
+        logger.error("❌ Ошибка при парсинге JSON: %s", e)
         await message.answer("❌ Ошибка при обработке данных")
     except Exception as e:
-        logger.error(f"❌ Ошибка при обработке заявки: {type(e).__name__}: {e}", exc_info=True)
+        # Заявка не сохранилась — повторная отправка с тем же ключом должна пройти
+        if submission:
+            recent_submissions.invalidate(submission)
+        logger.error("❌ Ошибка при обработке заявки: %s: %s", type(e).__name__, e, exc_info=True)
         await message.answer(f"❌ Ошибка при отправке заявки: {str(e)}")
         
\ No newline at end of file
@@ -0,0 +1,109 @@
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.types import (
+    Message, CallbackQuery, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+)
+import logging
+import os
+from database import db
+from export import EXPORT_FORMATS, export_filename, parse_date, spool
+from config import STATUS_LABELS, EXPORT_MAX_DOCUMENT_MB
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+EXPORT_HELP = (
+    "📤 <b>Выгрузка заявок</b>\n\n"
+    "<code>/export [csv|jsonl] [с YYYY-MM-DD] [по YYYY-MM-DD] [статус]</code>\n\n"
+    "Например: <code>/export csv 2024-01-01 2024-03-31 accepted</code>\n"
+    "Статусы: new, " + ", ".join(STATUS_LABELS)
+)
+
+
+def parse_export_args(args: str) -> dict:
+    """Аргументы /export в любом порядке: формат, до двух дат, статус. ValueError — мусор"""
+    filters = {"fmt": "csv", "date_from": None, "date_to": None, "status": None}
+    dates = []
+    for token in (args or "").split():
+        token = token.lower()
+        if token in EXPORT_FORMATS:
+            filters["fmt"] = token
+        elif token == "new" or token in STATUS_LABELS:
+            filters["status"] = token
+        else:
+            dates.append(parse_date(token).isoformat())
+    if len(dates) > 2:
+        raise ValueError("too many dates")
+    if dates:
+        filters["date_from"] = dates[0]
+        filters["date_to"] = dates[1] if len(dates) == 2 else None
+    return filters
+
+
+@router.message(Command("export"))
+async def export_start(message: Message, command: CommandObject, state: FSMContext):
+    owned = await db.get_owned_services(message.from_user.id)
+    if not owned:
+        await message.answer("❌ Выгружать заявки может только управляющий сервиса")
+        return
+    try:
+        filters = parse_export_args(command.args)
+    except ValueError:
+        await message.answer(EXPORT_HELP, parse_mode="HTML")
+        return
+
+    if len(owned) == 1:
+        await send_export(message, owned[0]['idservice'], filters)
+        return
+
+    # Фильтры не влезают в 64 байта callback_data — держим их в FSM
+    await state.update_data(export_filters=filters)
+    await message.answer(
+        "📤 Выберите сервис для выгрузки:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=s['service_name'], callback_data=f"ex:{s['idservice']}")]
+            for s in owned
+        ])
+    )
+
+
+@router.callback_query(F.data.startswith("ex:"))
+async def export_pick_service(callback: CallbackQuery, state: FSMContext):
+    idservice = callback.data[3:]
+    owned = await db.get_owned_services(callback.from_user.id)
+    if not any(s['idservice'] == idservice for s in owned):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    data = await state.get_data()
+    await callback.answer("⏳ Готовлю выгрузку…")
+    await send_export(callback.message, idservice, data.get("export_filters") or parse_export_args(""))
+
+
+async def send_export(message: Message, idservice: str, filters: dict):
+    """
+    Курсор -> временный файл -> sendDocument. Через файл, а не напрямую в Telegram:
+    соединение с БД освобождается со скоростью диска, а не загрузки в Bot API.
+    """
+    fmt = filters["fmt"]
+    batches = db.iter_service_requests(
+        idservice, parse_date(filters["date_from"]), parse_date(filters["date_to"]),
+        filters["status"]
+    )
+    path, size = await spool(batches, fmt)
+    try:
+        if size > EXPORT_MAX_DOCUMENT_MB * 1024 * 1024:
+            await message.answer(
+                "⚠️ Выгрузка больше лимита Telegram на файл.\n"
+                "Сузьте период или скачайте её через API: "
+                f"<code>/api/service/{idservice}/export</code>",
+                parse_mode="HTML"
+            )
+            return
+        await message.answer_document(
+            FSInputFile(path, filename=export_filename(idservice, fmt)),
+            caption="📤 Заявки сервиса"
+        )
+        logger.info("📤 Выгрузка %s сервиса %s: %d байт", fmt, idservice, size)
+    finally:
+        os.unlink(path)
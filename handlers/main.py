@@ -2,18 +2,29 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from database import db
-from keyboards import start_keyboard, admin_menu_keyboard, CLIENT_NOTIFY
-from config import SERVICE_NAMES, URGENCY_NAMES, STATUS_LABELS
+from aiogram.exceptions import TelegramBadRequest
+from keyboards import (
+    start_keyboard, admin_menu_keyboard, CLIENT_NOTIFY,
+    browse_services_keyboard, requests_page_keyboard
+)
+from config import (
+    SERVICE_NAMES, URGENCY_NAMES, STATUS_LABELS, NEW_STATUS_LABEL, REQUEST_FILTERS
+)
+from log_config import request_id_var
 import logging
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+def status_label(status: str) -> str:
+    """Подпись статуса заявки; у новой своя, её нет в STATUS_LABELS"""
+    return STATUS_LABELS.get(status, NEW_STATUS_LABEL)
+
 # ===== АДМИН КОМАНДЫ =====
 @router.message(F.text == "📋 Мои заявки")
 async def my_requests(message: Message):
-    services = await db.get_admin_services(message.from_user.id)
-    if not services:
+    rows = await db.get_admin_recent_requests(message.from_user.id, per_service=5)
+    if not rows:
         await message.answer(
             "❌ У вас нет зарегистрированных сервисов\n\n"
             "Используйте команду /register_service для регистрации",
@@ -22,17 +33,70 @@ async def my_requests(message: Message):
         return
 
     requests_list = "<b>📋 Мои заявки:</b>\n\n"
-    for service in services:
-        requests = await db.get_service_requests(service['idservice'])
-        if requests:
-            requests_list += f"<b>{service['service_name']}</b>\n"
-            for req in requests[:5]:
-                status_label = STATUS_LABELS.get(req['status'], req['status'])
-                requests_list += f"  • {req['client_name']} — {status_label}\n"
-        else:
-            requests_list += f"<b>{service['service_name']}</b> — нет заявок\n"
+    current_service = None
+    services = []
+    for row in rows:
+        if row['idservice'] != current_service:
+            current_service = row['idservice']
+            services.append((row['idservice'], row['service_name']))
+            if row['client_name'] is None:
+                requests_list += f"<b>{row['service_name']}</b> — нет заявок\n"
+                continue
+            requests_list += f"<b>{row['service_name']}</b>\n"
+        requests_list += f"  • {row['client_name']} — {status_label(row['status'])}\n"
+
+    await message.answer(
+        requests_list, parse_mode="HTML",
+        reply_markup=browse_services_keyboard(services)
+    )
 
-    await message.answer(requests_list, parse_mode="HTML")
+# ===== БРАУЗЕР ЗАЯВОК (keyset-пагинация) =====
+REQUESTS_PAGE_SIZE = 10
+
+@router.callback_query(F.data.startswith("rq:"))
+async def browse_requests(callback: CallbackQuery):
+    _, action, ref, status = callback.data.split(":", 3)
+    if status not in REQUEST_FILTERS:
+        await callback.answer("❌ Неизвестный фильтр", show_alert=True)
+        return
+
+    rows, has_more = await db.get_requests_page(
+        callback.from_user.id,
+        idservice=ref if action == "f" else None,
+        cursor=ref if action != "f" else None,
+        newer=action == "p",
+        status=None if status == "all" else status,
+        limit=REQUESTS_PAGE_SIZE
+    )
+
+    if not rows:
+        if action != "f":
+            await callback.answer("Больше заявок нет")
+            return
+        text = "<b>🗂 Заявки</b>\n\nНет заявок"
+        keyboard = requests_page_keyboard(ref, status)
+    else:
+        # Листали к старым — новее точно есть, и наоборот
+        has_newer = has_more if action == "p" else action == "n"
+        has_older = has_more if action != "p" else True
+        text = f"<b>🗂 {rows[0]['service_name']}</b>\n\n"
+        for req in rows:
+            text += (
+                f"• {req['createdate'].strftime('%d.%m.%Y %H:%M')} — {req['client_name']}\n"
+                f"  {req['brand']} {req['model']} — {status_label(req['status'])}\n"
+            )
+        keyboard = requests_page_keyboard(
+            rows[0]['idservice'], status,
+            newer_id=rows[0]['idrequests'] if has_newer else None,
+            older_id=rows[-1]['idrequests'] if has_older else None
+        )
+
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except TelegramBadRequest:
+        # «message is not modified» — повторное нажатие той же кнопки
+        pass
+    await callback.answer()
 
 @router.message(F.text == "📝 Зарегистрировать новый сервис")
 async def register_new_service(message: Message, state: FSMContext):
@@ -67,40 +131,68 @@ async def service_info(message: Message):
         )
     await message.answer(info, parse_mode="HTML")
 
+STATS_DAYS = 7
+
+def format_duration(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return f"{hours} ч {minutes} мин"
+    return f"{hours // 24} дн {hours % 24} ч"
+
+@router.message(F.text == "📊 Статистика")
+async def service_stats(message: Message):
+    services = await db.get_admin_services(message.from_user.id)
+    if not services:
+        await message.answer("❌ У вас нет сервисов")
+        return
+
+    stats = await db.get_service_stats([s['idservice'] for s in services], days=STATS_DAYS)
+    text = "<b>📊 Статистика</b>\n"
+    for st in stats:
+        by_status = st['by_status']
+        text += (
+            f"\n<b>{st['service_name']}</b>\n"
+            f"Всего заявок: <b>{st['total']}</b>\n"
+            f"{NEW_STATUS_LABEL}: {by_status['new']}\n"
+            + "".join(f"{label}: {by_status[key]}\n" for key, label in STATUS_LABELS.items())
+        )
+        if st['avg_response_seconds'] is not None:
+            text += f"⏱ Среднее время реакции: {format_duration(st['avg_response_seconds'])}\n"
+        per_day = ", ".join(str(d['created']) for d in st['daily'])
+        text += f"📅 Заявок за {STATS_DAYS} дн (по дням): {per_day}\n"
+    await message.answer(text, parse_mode="HTML")
+
 # ===== ОБРАБОТКА СТАТУСОВ =====
 @router.callback_query(F.data.startswith("status:"))
 async def admin_status_handler(callback: CallbackQuery):
     try:
         _, status, request_id = callback.data.split(":", 2)
+        request_id_var.set(request_id)
 
-        await db.update_request_status(request_id, status)
+        if status not in STATUS_LABELS:
+            await callback.answer("❌ Неизвестный статус", show_alert=True)
+            return
+
+        # Смена статуса и уведомление клиенту (через outbox) — один запрос
+        result = await db.transition_request_status(
+            request_id, status, CLIENT_NOTIFY.get(status)
+        )
+        if result is None:
+            await callback.answer("❌ Заявка не найдена", show_alert=True)
+            return
+        if not result['changed']:
+            await callback.answer("ℹ️ Этот статус уже установлен")
+            return
 
         new_text = callback.message.html_text + f"\n\n<b>📌 Статус:</b> {STATUS_LABELS[status]}"
         await callback.message.edit_text(new_text, parse_mode="HTML")
         await callback.answer("✅ Статус обновлён")
 
-        # Уведомляем клиента
-        request = await db.get_request(request_id)
-        if request and request['idclienttg']:
-            try:
-                client_id = int(request['idclienttg'])
-                notify_text = CLIENT_NOTIFY.get(status, "")
-                if notify_text:
-                    service = await db.get_service_by_id(request['idservice'])
-                    svc_name = service['service_name'] if service else "Автосервис"
-                    await callback.bot.send_message(
-                        client_id,
-                        f"{notify_text}\n\n"
-                        f"<b>Сервис:</b> {svc_name}\n"
-                        f"<b>Номер заявки:</b> <code>{request_id}</code>",
-                        parse_mode="HTML"
-                    )
-                    logger.info(f"✅ Уведомление отправлено клиенту {client_id}")
-            except Exception as e:
-                logger.error(f"❌ Не удалось уведомить клиента: {e}")
-
     except Exception as e:
-        logger.error(f"❌ Ошибка при обновлении статуса: {e}", exc_info=True)
+        logger.error("❌ Ошибка при обновлении статуса: %s", e, exc_info=True)
         await callback.answer("❌ Ошибка при обновлении", show_alert=True)
 
 # ===== FALLBACK =====
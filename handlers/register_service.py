@@ -1,20 +1,25 @@
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import Message, ReplyKeyboardRemove
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
-from database import db
-from keyboards import start_keyboard
+from database import db, OutboxMessage
+from keyboards import start_keyboard, location_request_keyboard, SKIP_COORDINATES
+from geo import valid_coordinates
 import re
 
 router = Router()
 
+# «55.7558, 37.6173» или «55.7558 37.6173»
+COORDINATES_RE = re.compile(r"^\s*(-?\d{1,2}(?:\.\d+)?)\s*[,;\s]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
 # ===== РЕГИСТРАЦИЯ СЕРВИСА =====
 class RegisterService(StatesGroup):
     waiting_name     = State()
     waiting_phone    = State()
     waiting_city     = State()
     waiting_location = State()
+    waiting_coordinates = State()
     waiting_admin_id = State()
 
 @router.message(Command("register_service"))
@@ -71,11 +76,37 @@ async def process_service_location(message: Message, state: FSMContext):
         await message.answer("❌ Адрес должен быть не менее 5 символов")
         return
     await state.update_data(location=location)
+    await message.answer(
+        "🗺 <b>Где находится сервис на карте?</b>\n\n"
+        "Нажмите «📍 Отправить геопозицию», если вы сейчас в сервисе, "
+        "или выберите точку на карте через 📎 → Геопозиция.\n"
+        "Можно прислать координаты текстом: <code>55.7558, 37.6173</code>\n\n"
+        "<i>По ним клиенты найдут ближайший к себе сервис.</i>",
+        parse_mode="HTML", reply_markup=location_request_keyboard()
+    )
+    await state.set_state(RegisterService.waiting_coordinates)
+
+@router.message(RegisterService.waiting_coordinates)
+async def process_service_coordinates(message: Message, state: FSMContext):
+    lat = lon = None
+    if message.location:
+        lat, lon = message.location.latitude, message.location.longitude
+    elif message.text != SKIP_COORDINATES:
+        match = COORDINATES_RE.match(message.text or "")
+        if not match or not valid_coordinates(float(match[1]), float(match[2])):
+            await message.answer(
+                "❌ Не получилось разобрать координаты.\n\n"
+                "Пример: <code>55.7558, 37.6173</code> — или нажмите «⏭ Пропустить»",
+                parse_mode="HTML"
+            )
+            return
+        lat, lon = float(match[1]), float(match[2])
+    await state.update_data(lat=lat, lon=lon)
     await message.answer(
         "👤 <b>Введите администратора сервиса:</b>\n\n"
         "• <code>@username</code>\n"
         "• <code>123456789</code> (user ID из @userinfobot)",
-        parse_mode="HTML"
+        parse_mode="HTML", reply_markup=ReplyKeyboardRemove()
     )
     await state.set_state(RegisterService.waiting_admin_id)
 
@@ -89,7 +120,8 @@ async def process_admin_id(message: Message, state: FSMContext, bot):
         data = await state.get_data()
         idservice = await db.add_service(
             data['service_name'], data['phone'],
-            message.from_user.id, data['location'], data['city']
+            message.from_user.id, data['location'], data['city'],
+            data.get('lat'), data.get('lon')
         )
         await db.add_admin(idservice, admin_id)
 
@@ -101,19 +133,15 @@ async def process_admin_id(message: Message, state: FSMContext, bot):
             ),
             parse_mode="HTML", reply_markup=start_keyboard()
         )
-        try:
-            await bot.send_message(
-                admin_id,
-                f"👋 Вас добавили администратором автосервиса!\n\n"
-                f"<b>Название:</b> {data['service_name']}\n"
-                f"<b>Телефон:</b> {data['phone']}\n"
-                f"<b>Город:</b> {data['city']}\n"
-                f"<b>Адрес:</b> {data['location']}\n\n"
-                f"Нажмите /start для управления заявками.",
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            print(f"Не удалось уведомить админа: {e}")
+        await db.enqueue(OutboxMessage(
+            "admin_added", admin_id,
+            f"👋 Вас добавили администратором автосервиса!\n\n"
+            f"<b>Название:</b> {data['service_name']}\n"
+            f"<b>Телефон:</b> {data['phone']}\n"
+            f"<b>Город:</b> {data['city']}\n"
+            f"<b>Адрес:</b> {data['location']}\n\n"
+            f"Нажмите /start для управления заявками."
+        ))
     except Exception as e:
         await message.answer(f"❌ Ошибка при регистрации\n\n<code>{e}</code>", parse_mode="HTML")
 
@@ -181,25 +209,18 @@ async def add_admin_finish(message: Message, state: FSMContext, bot):
     data = await state.get_data()
     service_id = data['service_id']
 
-    # Проверяем активных администраторов
-    existing = await db.get_admins_by_service(service_id)
-    if any(a['idusertg'] == admin_id for a in existing):
+    result = await db.add_admin(service_id, admin_id)
+    if result == "active":
         await message.answer("⚠️ Этот пользователь уже является администратором.")
         await state.clear()
         return
 
-    await db.add_admin(service_id, admin_id)
-
-    try:
-        service = await db.get_service_by_id(service_id)
-        svc_name = service['service_name'] if service else "сервис"
-        await bot.send_message(
-            admin_id,
-            f"👋 Вас добавили администратором!\n\n<b>Сервис:</b> {svc_name}\n\nНажмите /start.",
-            parse_mode="HTML"
-        )
-    except Exception as e:
-        print(f"Не удалось уведомить нового админа: {e}")
+    service = await db.get_service_by_id(service_id)
+    svc_name = service['service_name'] if service else "сервис"
+    await db.enqueue(OutboxMessage(
+        "admin_added", admin_id,
+        f"👋 Вас добавили администратором!\n\n<b>Сервис:</b> {svc_name}\n\nНажмите /start."
+    ))
 
     await message.answer(f"✅ Администратор <code>{admin_id}</code> успешно добавлен!", parse_mode="HTML")
     await state.clear()
@@ -280,16 +301,12 @@ async def remove_admin_finish(message: Message, state: FSMContext, bot):
     await db.remove_admin(service_id, admin_id)
 
     # Уведомляем удалённого админа
-    try:
-        service = await db.get_service_by_id(service_id)
-        svc_name = service['service_name'] if service else "сервис"
-        await bot.send_message(
-            admin_id,
-            f"ℹ️ Вы были удалены из администраторов сервиса <b>{svc_name}</b>.",
-            parse_mode="HTML"
-        )
-    except Exception as e:
-        print(f"Не удалось уведомить удалённого админа: {e}")
+    service = await db.get_service_by_id(service_id)
+    svc_name = service['service_name'] if service else "сервис"
+    await db.enqueue(OutboxMessage(
+        "admin_removed", admin_id,
+        f"ℹ️ Вы были удалены из администраторов сервиса <b>{svc_name}</b>."
+    ))
 
     await message.answer(
         f"✅ Администратор <code>{admin_id}</code> удалён.", parse_mode="HTML"
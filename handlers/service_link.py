@@ -12,8 +12,8 @@ router = Router()
 @router.message(CommandStart())
 async def start_with_service_link(message: Message):
     """Обработка /start SVC_xxxx"""
-    logger.info(f"📥 Получена команда /start: {message.text}")
-    
+    logger.debug("📥 Получена команда /start: %s", message.text)
+
     # Получаем параметр из /start
     arg = None
     if message.text.startswith("/start "):
@@ -21,15 +21,10 @@ async def start_with_service_link(message: Message):
         if len(parts) == 2:
             arg = parts[1]
     
-    logger.info(f"🔍 Параметр: {arg}")
-    
     # ✅ Если пришла ссылка с SVC_ — показываем форму для этого сервиса
     if arg and arg.startswith("SVC_"):
         service_id = arg[4:]  # Убираем префикс "SVC_"
-        logger.info(f"🎯 Обнаружена ссылка сервиса: {service_id}")
-        
         web_app_url = f"{URL_SITE}?service_id={service_id}"
-        logger.info(f"🌐 URL web app: {web_app_url}")
         
         # ✅ ПРАВИЛЬНЫЙ СПОСОБ: ReplyKeyboardMarkup с KeyboardButton
         keyboard = ReplyKeyboardMarkup(
@@ -49,18 +44,16 @@ async def start_with_service_link(message: Message):
             parse_mode="HTML",
             reply_markup=keyboard
         )
-        logger.info(f"✅ Кнопка web app отправлена пользователю {message.from_user.id}")
+        logger.info("✅ Кнопка web app сервиса %s отправлена пользователю %s", service_id, message.from_user.id)
         return
     
     # ===== СТАНДАРТНАЯ ЛОГИКА /start (если нет параметра SVC_) =====
-    logger.info(f"👤 Пользователь {message.from_user.id} нажал /start без параметра")
-    
     # Проверяем, админ ли это
     user_services = await db.get_admin_services(message.from_user.id)
     
     if user_services:
         from keyboards import admin_menu_keyboard
-        logger.info(f"✅ Пользователь {message.from_user.id} - администратор")
+        logger.info("✅ /start: пользователь %s - администратор", message.from_user.id)
         await message.answer(
             "👋 <b>Добро пожаловать, администратор!</b>",
             parse_mode="HTML",
@@ -68,7 +61,7 @@ async def start_with_service_link(message: Message):
         )
     else:
         from keyboards import start_keyboard
-        logger.info(f"👥 Пользователь {message.from_user.id} - клиент")
+        logger.info("👥 /start: пользователь %s - клиент", message.from_user.id)
         await message.answer(
             "🚗 <b>Добро пожаловать в систему записи автосервиса!</b>\n\n",
             parse_mode="HTML",
@@ -2,7 +2,7 @@ from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton, WebAppInfo,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
-from config import URL_SITE
+from config import URL_SITE, REQUEST_FILTERS
 
 # ===== УВЕДОМЛЕНИЯ КЛИЕНТУ =====
 CLIENT_NOTIFY = {
@@ -39,6 +39,19 @@ def register_service_keyboard():
         resize_keyboard=True
     )
 
+SKIP_COORDINATES = "⏭ Пропустить"
+
+def location_request_keyboard():
+    """Шаг координат при регистрации сервиса"""
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="📍 Отправить геопозицию", request_location=True)],
+            [KeyboardButton(text=SKIP_COORDINATES)]
+        ],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+
 # ===== АДМИН КНОПКИ =====
 def admin_keyboard(request_id: str):
     """Кнопки для обновления статуса заявки"""
@@ -57,7 +70,34 @@ def admin_menu_keyboard():
     return ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="📋 Мои заявки")],
-            [KeyboardButton(text="ℹ️ О моем сервисе")]
+            [KeyboardButton(text="📊 Статистика"), KeyboardButton(text="ℹ️ О моем сервисе")]
         ],
         resize_keyboard=True
-    )
\ No newline at end of file
+    )
+
+# ===== БРАУЗЕР ЗАЯВОК =====
+# callback_data: rq:f:<idservice>:<status> — первая страница,
+#                rq:n:<idrequest>:<status> / rq:p:<idrequest>:<status> — старее / новее
+def browse_services_keyboard(services):
+    """Кнопки «открыть все заявки» под сводкой «Мои заявки»"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"🗂 {name}", callback_data=f"rq:f:{idservice}:all")]
+        for idservice, name in services
+    ])
+
+def requests_page_keyboard(idservice: str, status: str,
+                           newer_id: str = None, older_id: str = None):
+    """Навигация по страницам заявок и фильтр по статусу"""
+    filters = [
+        InlineKeyboardButton(
+            text=f"• {label} •" if key == status else label,
+            callback_data=f"rq:f:{idservice}:{key}"
+        )
+        for key, label in REQUEST_FILTERS.items()
+    ]
+    nav = []
+    if newer_id:
+        nav.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"rq:p:{newer_id}:{status}"))
+    if older_id:
+        nav.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"rq:n:{older_id}:{status}"))
+    return InlineKeyboardMarkup(inline_keyboard=[filters, nav] if nav else [filters])
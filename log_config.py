@@ -0,0 +1,132 @@
+"""
+Логирование bot.py и api.py: структурированный JSON без блокировки event loop.
+
+Хендлер на корневом логгере только кладёт запись в очередь; форматирование
+и запись в stdout выполняет QueueListener в отдельном потоке. К каждой записи
+добавляются update_id и request_id из contextvars (их ставят LogContextMiddleware
+и хендлеры заявок). Поток «болтовни» по апдейтам (INFO из handlers, aiogram.event,
+notifications) можно срезать уровнем LOG_CHATTER_LEVEL или семплированием
+LOG_SAMPLE_RATE — решение принимается на апдейт целиком.
+"""
+import atexit
+import json
+import logging
+import queue
+import sys
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+
+from config import LOG_FORMAT, LOG_LEVEL, LOG_CHATTER_LEVEL, LOG_SAMPLE_RATE
+
+update_id_var: ContextVar[Optional[int]] = ContextVar("update_id", default=None)
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Логгеры, которые пишут по несколько строк на каждый апдейт
+CHATTER_LOGGERS = ("handlers", "aiogram.event", "notifications")
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+                  + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in ("update_id", "request_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Проставляет id из contextvars и семплирует болтовню по апдейтам"""
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        update_id = record.update_id = update_id_var.get()
+        record.request_id = request_id_var.get()
+        if (self.sample_rate < 1 and update_id is not None
+                and record.levelno < logging.WARNING
+                and record.name.startswith(CHATTER_LOGGERS)):
+            # Детерминированно по update_id: апдейт попадает в лог целиком или не попадает
+            return (update_id * 2654435761 % 2 ** 32) / 2 ** 32 < self.sample_rate
+        return True
+
+
+class LoopQueueHandler(QueueHandler):
+    """
+    QueueHandler без форматирования в вызывающем потоке: подставляем только args,
+    трейсбек и JSON собирает поток QueueListener
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(service: str):
+    """Идемпотентно: в webhook-режиме api.py импортирует bot.py"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter(service))
+    else:
+        stream.setFormatter(logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        ))
+
+    log_queue = queue.SimpleQueue()
+    handler = LoopQueueHandler(log_queue)
+    handler.addFilter(ContextFilter(LOG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    for name in CHATTER_LOGGERS:
+        logging.getLogger(name).setLevel(LOG_CHATTER_LEVEL)
+    # uvicorn ставит свои StreamHandler'ы — переводим его логгеры в общую очередь
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: update_id во всех записях апдейта"""
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        update_token = update_id_var.set(event.update_id)
+        request_token = request_id_var.set(None)
+        try:
+            return await handler(event, data)
+        finally:
+            request_id_var.reset(request_token)
+            update_id_var.reset(update_token)
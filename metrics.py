@@ -0,0 +1,133 @@
+import functools
+import inspect
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# ===== МЕТРИКИ =====
+HANDLER_LATENCY = Histogram(
+    "bot_handler_seconds", "Время обработки апдейта хендлером aiogram",
+    ["handler", "event"]
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения, вылетевшие из хендлера",
+    ["handler", "event"]
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_seconds", "Время выполнения метода Database",
+    ["method"], buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+DB_QUERY_ERRORS = Counter(
+    "db_query_errors_total", "Ошибки методов Database", ["method"]
+)
+DB_POOL_SIZE = Gauge("db_pool_size", "Соединений в пуле asyncpg")
+DB_POOL_IDLE = Gauge("db_pool_idle", "Свободных соединений в пуле asyncpg")
+DB_POOL_WAITERS = Gauge("db_pool_waiters", "Корутин, ждущих соединение из пула")
+TELEGRAM_LATENCY = Histogram(
+    "telegram_api_seconds", "Время вызова Telegram Bot API", ["method"]
+)
+TELEGRAM_ERRORS = Counter(
+    "telegram_api_errors_total", "Ошибки Telegram Bot API (кроме 429)", ["method"]
+)
+TELEGRAM_FLOOD = Counter(
+    "telegram_api_flood_total", "Ответы 429 (flood control) от Telegram", ["method"]
+)
+SUBMISSIONS_REJECTED = Counter(
+    "bot_submissions_rejected_total", "Заявки web app, отклонённые до обработки",
+    ["reason"]
+)
+OUTBOUND_MESSAGES = Counter(
+    "outbound_messages_total", "Исходящие уведомления outbox по типу и результату",
+    ["kind", "result"]
+)
+
+
+# ===== AIOGRAM =====
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware: гистограмма задержки по каждому хендлеру"""
+
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(name, self.event).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(name, self.event).observe(time.perf_counter() - started)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: задержка и ошибки каждого вызова Bot API"""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            TELEGRAM_FLOOD.labels(name).inc()
+            raise
+        except Exception:
+            TELEGRAM_ERRORS.labels(name).inc()
+            raise
+        finally:
+            TELEGRAM_LATENCY.labels(name).observe(time.perf_counter() - started)
+
+
+def instrument_dispatcher(dp):
+    # Inner-middleware диспетчера распространяются на все подключённые роутеры
+    dp.message.middleware(HandlerMetricsMiddleware("message"))
+    dp.callback_query.middleware(HandlerMetricsMiddleware("callback_query"))
+
+
+def instrument_bot(bot: Bot):
+    bot.session.middleware(TelegramMetricsMiddleware())
+
+
+# ===== БАЗА ДАННЫХ =====
+def _timed(name: str, method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            DB_QUERY_ERRORS.labels(name).inc()
+            raise
+        finally:
+            DB_QUERY_LATENCY.labels(name).observe(time.perf_counter() - started)
+    wrapper.__metrics_timed__ = True
+    return wrapper
+
+
+def instrument_database(database_cls):
+    """Обернуть все публичные async-методы Database таймером (один раз на класс)"""
+    skip = {"connect", "close", "listen"}
+    for name, method in list(vars(database_cls).items()):
+        if (name.startswith("_") or name in skip or not inspect.iscoroutinefunction(method)
+                or getattr(method, "__metrics_timed__", False)):
+            continue
+        setattr(database_cls, name, _timed(name, method))
+
+
+def instrument_pool(database):
+    """Гейджи пула читаются в момент сбора метрик — без фоновых задач"""
+    DB_POOL_SIZE.set_function(lambda: database.pool.get_size() if database.pool else 0)
+    DB_POOL_IDLE.set_function(lambda: database.pool.get_idle_size() if database.pool else 0)
+    DB_POOL_WAITERS.set_function(database.pool_waiters)
+
+
+def start_metrics_server(port: int):
+    """Отдельный порт /metrics для процесса бота (в api.py метрики отдаёт сам FastAPI)"""
+    start_http_server(port)
@@ -0,0 +1,398 @@
+"""
+Версионированные миграции схемы БД.
+
+Запускаются из Database.connect() (если DB_AUTO_MIGRATE) или вручную:
+    python migrations.py
+Применённые версии хранятся в schema_migrations. Индексы на больших таблицах
+создаются через CREATE INDEX CONCURRENTLY, чтобы не блокировать запись.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-lock: одновременно мигрирует только один процесс (bot / api / реплики)
+MIGRATION_LOCK_KEY = 7_245_101
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    statements: list[str]
+    # False — для CREATE INDEX CONCURRENTLY: каждый оператор выполняется отдельно,
+    # вне транзакции; недостроенный (INVALID) индекс пересоздаётся
+    transactional: bool = True
+
+
+MIGRATIONS = [
+    Migration(1, "base tables", ["""
+        CREATE TABLE IF NOT EXISTS services (
+            idservice        TEXT PRIMARY KEY,
+            service_name     TEXT NOT NULL,
+            service_number   TEXT NOT NULL DEFAULT '',
+            owner_id         BIGINT NOT NULL,
+            location_service TEXT NOT NULL DEFAULT '',
+            city             TEXT NOT NULL DEFAULT '',
+            createdate       TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE TABLE IF NOT EXISTS admins (
+            idadmins    TEXT PRIMARY KEY,
+            idservice   TEXT NOT NULL REFERENCES services (idservice),
+            idusertg    BIGINT NOT NULL,
+            idrecstatus INT NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS requests (
+            idrequests   TEXT PRIMARY KEY,
+            idservice    TEXT NOT NULL DEFAULT '',
+            client_name  TEXT,
+            phone        TEXT,
+            brand        TEXT,
+            model        TEXT,
+            plate        TEXT,
+            service_type TEXT,
+            urgency      TEXT,
+            comment      TEXT,
+            idclienttg   BIGINT,
+            status       TEXT NOT NULL DEFAULT 'new',
+            createdate   TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """]),
+
+    # Уникальность (idservice, idusertg): перед созданием индекса схлопываем дубли,
+    # оставляя активную запись
+    Migration(2, "admins unique membership", ["""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'admins_service_user_uq') THEN
+                DELETE FROM admins a
+                USING admins b
+                WHERE a.idservice = b.idservice AND a.idusertg = b.idusertg
+                  AND (a.idrecstatus < b.idrecstatus
+                       OR (a.idrecstatus = b.idrecstatus AND a.idadmins > b.idadmins));
+                CREATE UNIQUE INDEX admins_service_user_uq ON admins (idservice, idusertg);
+            END IF;
+        END $$;
+    """]),
+
+    Migration(3, "outbox, processed updates, fsm storage", ["""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id              BIGSERIAL PRIMARY KEY,
+            kind            TEXT NOT NULL,
+            chat_id         BIGINT NOT NULL,
+            text            TEXT NOT NULL,
+            reply_markup    TEXT,
+            status          TEXT NOT NULL DEFAULT 'pending',
+            attempts        INT NOT NULL DEFAULT 0,
+            last_error      TEXT,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+            sent_at         TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS outbox_pending_idx
+            ON outbox (next_attempt_at, id) WHERE status = 'pending';
+
+        -- update_id уже принятых webhook-апдейтов (защита от повторной обработки репликами)
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id  BIGINT PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            bot_id                 BIGINT NOT NULL,
+            chat_id                BIGINT NOT NULL,
+            user_id                BIGINT NOT NULL,
+            thread_id              BIGINT NOT NULL DEFAULT 0,
+            business_connection_id TEXT NOT NULL DEFAULT '',
+            destiny                TEXT NOT NULL DEFAULT 'default',
+            state                  TEXT,
+            data                   JSONB NOT NULL DEFAULT '{}',
+            updated_at             TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny)
+        );
+        CREATE INDEX IF NOT EXISTS fsm_storage_updated_idx ON fsm_storage (updated_at);
+    """]),
+
+    Migration(4, "hot query indexes", [
+        # get_service_requests / get_admin_recent_requests / get_requests_page (keyset)
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS requests_service_created_idx
+           ON requests (idservice, createdate DESC, idrequests DESC)""",
+        # get_admin_services / get_admin_recent_requests: активные сервисы админа
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS admins_user_active_idx
+           ON admins (idusertg, idservice) WHERE idrecstatus = 0""",
+        # get_admins_by_service: активные админы сервиса
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS admins_service_active_idx
+           ON admins (idservice, idusertg) WHERE idrecstatus = 0""",
+        # get_service_by_owner / get_owned_services
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS services_owner_idx
+           ON services (owner_id, service_name)""",
+        # get_services_by_city: выражение совпадает с WHERE, service_name — с ORDER BY
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS services_city_norm_idx
+           ON services (LOWER(TRIM(city)), service_name)""",
+    ], transactional=False),
+
+    # Аналитика по сервисам: дневные агрегаты ведёт триггер на requests, отчёт
+    # читает их одним индексным запросом вместо скана заявок (get_service_stats).
+    # d_* — изменение числа заявок в статусе за день: сумма по всем дням даёт текущие
+    # счётчики. Время первой реакции (new -> accepted/called) копится с момента
+    # миграции — у старых заявок истории переходов нет.
+    Migration(5, "service analytics rollups", ["""
+        CREATE TABLE IF NOT EXISTS service_daily_stats (
+            idservice        TEXT NOT NULL,
+            day              DATE NOT NULL,
+            created          INT NOT NULL DEFAULT 0,
+            accepted         INT NOT NULL DEFAULT 0,
+            called           INT NOT NULL DEFAULT 0,
+            rejected         INT NOT NULL DEFAULT 0,
+            d_new            INT NOT NULL DEFAULT 0,
+            d_accepted       INT NOT NULL DEFAULT 0,
+            d_called         INT NOT NULL DEFAULT 0,
+            d_rejected       INT NOT NULL DEFAULT 0,
+            responded        INT NOT NULL DEFAULT 0,
+            response_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (idservice, day)
+        );
+
+        CREATE OR REPLACE FUNCTION service_stats_on_request() RETURNS trigger AS $$
+        DECLARE
+            prev TEXT := CASE WHEN TG_OP = 'UPDATE' THEN OLD.status END;
+            first_response BOOLEAN := TG_OP = 'UPDATE' AND OLD.status = 'new'
+                                      AND NEW.status IN ('accepted', 'called');
+        BEGIN
+            INSERT INTO service_daily_stats AS s (
+                idservice, day, created, accepted, called, rejected,
+                d_new, d_accepted, d_called, d_rejected, responded, response_seconds
+            ) VALUES (
+                NEW.idservice, current_date,
+                (TG_OP = 'INSERT')::int,
+                (TG_OP = 'UPDATE' AND NEW.status = 'accepted')::int,
+                (TG_OP = 'UPDATE' AND NEW.status = 'called')::int,
+                (TG_OP = 'UPDATE' AND NEW.status = 'rejected')::int,
+                (NEW.status = 'new')::int - (prev IS NOT DISTINCT FROM 'new')::int,
+                (NEW.status = 'accepted')::int - (prev IS NOT DISTINCT FROM 'accepted')::int,
+                (NEW.status = 'called')::int - (prev IS NOT DISTINCT FROM 'called')::int,
+                (NEW.status = 'rejected')::int - (prev IS NOT DISTINCT FROM 'rejected')::int,
+                first_response::int,
+                CASE WHEN first_response THEN extract(epoch FROM now() - NEW.createdate) ELSE 0 END
+            )
+            ON CONFLICT (idservice, day) DO UPDATE SET
+                created          = s.created + EXCLUDED.created,
+                accepted         = s.accepted + EXCLUDED.accepted,
+                called           = s.called + EXCLUDED.called,
+                rejected         = s.rejected + EXCLUDED.rejected,
+                d_new            = s.d_new + EXCLUDED.d_new,
+                d_accepted       = s.d_accepted + EXCLUDED.d_accepted,
+                d_called         = s.d_called + EXCLUDED.d_called,
+                d_rejected       = s.d_rejected + EXCLUDED.d_rejected,
+                responded        = s.responded + EXCLUDED.responded,
+                response_seconds = s.response_seconds + EXCLUDED.response_seconds;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS requests_stats_insert ON requests;
+        CREATE TRIGGER requests_stats_insert
+            AFTER INSERT ON requests
+            FOR EACH ROW EXECUTE FUNCTION service_stats_on_request();
+        -- Повторная установка того же статуса агрегаты не трогает
+        DROP TRIGGER IF EXISTS requests_stats_status ON requests;
+        CREATE TRIGGER requests_stats_status
+            AFTER UPDATE OF status ON requests
+            FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+            EXECUTE FUNCTION service_stats_on_request();
+
+        -- Заполнение по уже существующим заявкам (в той же транзакции, что и триггер)
+        LOCK TABLE requests IN SHARE MODE;
+        INSERT INTO service_daily_stats (idservice, day, created, d_new, d_accepted, d_called, d_rejected)
+        SELECT idservice, createdate::date, count(*),
+               count(*) FILTER (WHERE status = 'new'),
+               count(*) FILTER (WHERE status = 'accepted'),
+               count(*) FILTER (WHERE status = 'called'),
+               count(*) FILTER (WHERE status = 'rejected')
+        FROM requests
+        GROUP BY idservice, createdate::date
+        ON CONFLICT (idservice, day) DO NOTHING;
+    """]),
+
+    # Нечёткий поиск для /api/autocomplete (Database.search_autocomplete)
+    Migration(6, "trigram search indexes", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS services_city_trgm_idx
+           ON services USING gin (LOWER(city) gin_trgm_ops)""",
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS services_name_trgm_idx
+           ON services USING gin (LOWER(service_name) gin_trgm_ops)""",
+    ], transactional=False),
+
+    # Координаты сервиса для /api/services/nearby (поиск — в памяти api.py, geo.py)
+    Migration(7, "service coordinates", ["""
+        ALTER TABLE services ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION;
+        ALTER TABLE services ADD COLUMN IF NOT EXISTS lon DOUBLE PRECISION;
+        ALTER TABLE services DROP CONSTRAINT IF EXISTS services_coordinates_check;
+        ALTER TABLE services ADD CONSTRAINT services_coordinates_check CHECK (
+            (lat IS NULL AND lon IS NULL)
+            OR (lat BETWEEN -90 AND 90 AND lon BETWEEN -180 AND 180)
+        );
+    """]),
+
+    # Ключ идемпотентности заявки из web app (Database.add_request): уникален
+    # в пределах клиента, старые заявки без ключа не участвуют
+    Migration(8, "request idempotency key", [
+        "ALTER TABLE requests ADD COLUMN IF NOT EXISTS idempotency_key TEXT",
+        """CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS requests_idempotency_uq
+           ON requests (idclienttg, idempotency_key) WHERE idempotency_key IS NOT NULL""",
+    ], transactional=False),
+
+    # Агрегаты вставок — одним upsert'ом на оператор: пачка group commit
+    # (Database._insert_requests_batch) трогает строку сервиса за день один раз,
+    # а строки разных сервисов блокируются в порядке idservice — без взаимных
+    # блокировок между одновременными пачками
+    Migration(9, "statement-level stats trigger for request inserts", ["""
+        CREATE OR REPLACE FUNCTION service_stats_on_insert() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO service_daily_stats AS s (
+                idservice, day, created, d_new, d_accepted, d_called, d_rejected
+            )
+            SELECT idservice, current_date, count(*),
+                   count(*) FILTER (WHERE status = 'new'),
+                   count(*) FILTER (WHERE status = 'accepted'),
+                   count(*) FILTER (WHERE status = 'called'),
+                   count(*) FILTER (WHERE status = 'rejected')
+            FROM inserted
+            GROUP BY idservice
+            ORDER BY idservice
+            ON CONFLICT (idservice, day) DO UPDATE SET
+                created    = s.created + EXCLUDED.created,
+                d_new      = s.d_new + EXCLUDED.d_new,
+                d_accepted = s.d_accepted + EXCLUDED.d_accepted,
+                d_called   = s.d_called + EXCLUDED.d_called,
+                d_rejected = s.d_rejected + EXCLUDED.d_rejected;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS requests_stats_insert ON requests;
+        CREATE TRIGGER requests_stats_insert
+            AFTER INSERT ON requests
+            REFERENCING NEW TABLE AS inserted
+            FOR EACH STATEMENT EXECUTE FUNCTION service_stats_on_insert();
+    """]),
+
+    # Версия сервиса для ETag в api.py: 304 сверяется по updated_at без полного запроса.
+    # Триггер — чтобы версию меняли и правки сервиса вручную
+    Migration(10, "service updated_at", ["""
+        -- Существующим строкам — время миграции (без перезаписи таблицы): на createdate
+        -- не опираемся, в созданных вручную таблицах его может не быть
+        ALTER TABLE services ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+        ALTER TABLE services ALTER COLUMN updated_at SET DEFAULT clock_timestamp();
+
+        CREATE OR REPLACE FUNCTION services_touch() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at := clock_timestamp();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS services_touch ON services;
+        CREATE TRIGGER services_touch
+            BEFORE UPDATE ON services
+            FOR EACH ROW EXECUTE FUNCTION services_touch();
+    """]),
+
+    # Сброс role_cache во всех процессах (Database.watch_roles): любое изменение
+    # членства — и из кода, и вручную — рассылает id пользователя
+    Migration(11, "admins change notifications", ["""
+        CREATE OR REPLACE FUNCTION admins_notify_roles() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN
+                PERFORM pg_notify('roles_changed', NEW.idusertg::text);
+            END IF;
+            IF TG_OP = 'DELETE' OR OLD.idusertg IS DISTINCT FROM NEW.idusertg THEN
+                PERFORM pg_notify('roles_changed', OLD.idusertg::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS admins_notify_roles ON admins;
+        CREATE TRIGGER admins_notify_roles
+            AFTER INSERT OR UPDATE OR DELETE ON admins
+            FOR EACH ROW EXECUTE FUNCTION admins_notify_roles();
+    """]),
+]
+
+
+async def _drop_invalid_index(conn, statement: str):
+    """Упавший CREATE INDEX CONCURRENTLY оставляет INVALID-индекс — IF NOT EXISTS его не пересоздаст"""
+    words = statement.split()
+    if "INDEX" not in words or "EXISTS" not in words:
+        return
+    name = words[words.index("EXISTS") + 1]
+    invalid = await conn.fetchval(
+        """SELECT NOT i.indisvalid FROM pg_index i
+           JOIN pg_class c ON c.oid = i.indexrelid
+           WHERE c.relname = $1""",
+        name
+    )
+    if invalid:
+        logger.warning(f"⚠️ Индекс {name} невалиден, пересоздаю")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+async def migrate(pool) -> list[int]:
+    """Применить недостающие миграции. Возвращает номера применённых версий"""
+    applied_now = []
+    async with pool.acquire() as conn:
+        # try-lock в цикле, а не pg_advisory_lock: ждущая сессия не должна держать
+        # открытую транзакцию, иначе CREATE INDEX CONCURRENTLY будет ждать её
+        while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_KEY):
+            await asyncio.sleep(0.5)
+        try:
+            await conn.execute(
+                """CREATE TABLE IF NOT EXISTS schema_migrations (
+                       version    INT PRIMARY KEY,
+                       name       TEXT NOT NULL,
+                       applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                   )"""
+            )
+            applied = {r['version'] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+
+            for m in MIGRATIONS:
+                if m.version in applied:
+                    continue
+                logger.info(f"🛠 Миграция {m.version}: {m.name}")
+                if m.transactional:
+                    async with conn.transaction():
+                        for statement in m.statements:
+                            await conn.execute(statement)
+                        await conn.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                            m.version, m.name
+                        )
+                else:
+                    for statement in m.statements:
+                        await _drop_invalid_index(conn, statement)
+                        await conn.execute(statement)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                        m.version, m.name
+                    )
+                applied_now.append(m.version)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
+    return applied_now
+
+
+async def _main():
+    from database import db
+    await db.connect(run_migrations=False)
+    try:
+        applied = await migrate(db.pool)
+        print(f"✅ Применены миграции: {applied}" if applied else "✅ Схема актуальна")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+)
+from config import TG_GLOBAL_RATE, TG_PER_CHAT_RATE, TG_SEND_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Сколько per-chat бакетов держим в памяти (самые старые вытесняются)
+MAX_CHAT_BUCKETS = 10_000
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        """Взять токен без ожидания: False — лимит исчерпан"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class SendResult:
+    chat_id: int
+    ok: bool
+    message_id: Optional[int] = None
+    error: Optional[str] = None
+    retryable: bool = True
+    # Flood control: повторить не раньше чем через столько секунд
+    retry_after: Optional[float] = None
+    # Попытка не начата — вышел deadline (аренда outbox)
+    expired: bool = False
+
+
+class Notifier:
+    """
+    Отправка сообщений в Telegram с учётом глобального лимита бота
+    и лимита на один чат. Получателей параллельно обслуживает outbox.py.
+    """
+
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE,
+                 per_chat_rate: float = TG_PER_CHAT_RATE,
+                 max_retries: int = TG_SEND_RETRIES):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self._chat_buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate)
+            self._chat_buckets[chat_id] = bucket
+            if len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def send(self, bot: Bot, chat_id: int, text: str,
+                   deadline: Optional[float] = None, **kwargs) -> SendResult:
+        """
+        Отправить одно сообщение с учётом лимитов и повторов сетевых ошибок.
+        Flood control не пережидается: retry_after возвращается вызывающему.
+        deadline (time.monotonic()) — не начинать попытку позже него
+        """
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            if deadline is not None and time.monotonic() >= deadline:
+                return SendResult(chat_id, False, error="deadline exceeded", expired=True)
+            try:
+                sent = await bot.send_message(chat_id, text, **kwargs)
+                return SendResult(chat_id, True, message_id=sent.message_id)
+            except TelegramRetryAfter as e:
+                logger.warning("⏳ Flood control для %s: повтор через %s с", chat_id, e.retry_after)
+                return SendResult(chat_id, False, error=str(e), retry_after=e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt == self.max_retries:
+                    return SendResult(chat_id, False, error=str(e))
+                logger.warning(f"⚠️ Ошибка отправки в {chat_id}, повтор через {delay} с: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                # Заблокировали бота, чат не найден и т.п. — повторять бессмысленно
+                return SendResult(chat_id, False, error=str(e), retryable=False)
+        return SendResult(chat_id, False, error="retries exhausted")
+
+
+notifier = Notifier()
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup
+from database import db
+from notifications import notifier
+from metrics import OUTBOUND_MESSAGES
+from config import (
+    OUTBOX_WORKERS, OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL,
+    OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS
+)
+
+logger = logging.getLogger(__name__)
+
+# Запас до конца аренды: последняя попытка отправки должна в него уложиться
+LEASE_MARGIN = 10
+
+
+class OutboxWorker:
+    """
+    Пул воркеров, который разбирает таблицу outbox и отправляет сообщения.
+    Просыпается по NOTIFY outbox, а на всякий случай ещё и по таймеру.
+    """
+
+    def __init__(self, bot: Bot, workers: int = OUTBOX_WORKERS,
+                 batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL,
+                 lease_seconds: float = OUTBOX_LEASE_SECONDS,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.bot = bot
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        await db.listen("outbox", self._on_notify, on_reconnect=self._on_relisten)
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.workers)]
+        logger.info(f"✅ Outbox запущен: {self.workers} воркеров")
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info("❌ Outbox остановлен")
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _on_notify(self, *args):
+        self._wakeup.set()
+
+    async def _on_relisten(self):
+        # NOTIFY за время обрыва потеряны — разбираем outbox, не дожидаясь таймера
+        self._wakeup.set()
+
+    async def _run(self, n: int):
+        while not self._stopping:
+            try:
+                batch = await db.claim_outbox(self.batch_size, self.lease_seconds)
+                if batch:
+                    await self._process(batch)
+                    # Пачка была полной — скорее всего, есть ещё
+                    if len(batch) == self.batch_size:
+                        continue
+            except Exception as e:
+                logger.error(f"❌ Outbox воркер {n}: {e}", exc_info=True)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _process(self, batch: list):
+        # Строки арендованы на lease_seconds: после этого их заберёт другой воркер,
+        # поэтому попытку, которую не успели начать с запасом, возвращаем в очередь
+        deadline = time.monotonic() + self.lease_seconds - min(LEASE_MARGIN, self.lease_seconds / 2)
+        await asyncio.gather(*(self._deliver(row, deadline) for row in batch))
+
+    async def _deliver(self, row, deadline: float):
+        """Отправка одной строки; результат пишется сразу, не дожидаясь остальной пачки"""
+        try:
+            result = await self._send(row, deadline)
+            if result.ok:
+                await db.complete_outbox([row['id']], [])
+                OUTBOUND_MESSAGES.labels(row['kind'], "sent").inc()
+                return
+            if result.expired:
+                await db.release_outbox(row['id'])
+                OUTBOUND_MESSAGES.labels(row['kind'], "released").inc()
+                return
+            if result.retry_after is not None:
+                # Flood control — не ошибка сообщения: откладываем, не «убивая»
+                retry_in = result.retry_after
+            elif result.retryable:
+                retry_in = self._retry_in(row['attempts'])
+            else:
+                retry_in = None
+            await db.complete_outbox([], [(row['id'], result.error, retry_in)])
+            OUTBOUND_MESSAGES.labels(row['kind'], "retry" if retry_in is not None else "dead").inc()
+            logger.error(
+                "❌ Outbox #%s (%s) → %s: попытка %s: %s",
+                row['id'], row['kind'], row['chat_id'], row['attempts'], result.error
+            )
+        except Exception as e:
+            # Строка вернётся в очередь по истечении аренды
+            logger.error("❌ Outbox #%s: %s", row['id'], e, exc_info=True)
+
+    async def _send(self, row, deadline: float):
+        markup = None
+        if row['reply_markup']:
+            markup = InlineKeyboardMarkup.model_validate_json(row['reply_markup'])
+        return await notifier.send(
+            self.bot, row['chat_id'], row['text'], deadline=deadline,
+            parse_mode="HTML", reply_markup=markup
+        )
+
+    def _retry_in(self, attempts: int) -> Optional[float]:
+        """Экспоненциальная задержка; None — сообщение «умерло»"""
+        if attempts >= self.max_attempts:
+            return None
+        return min(2 ** attempts, 600)
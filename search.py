@@ -0,0 +1,89 @@
+"""
+Поиск для web app: префиксный индекс городов в памяти api.py.
+
+Городов немного, поэтому весь справочник (город -> число сервисов) держим
+отсортированным списком ключей и ищем префикс бинарным поиском. Ключ
+нормализован (регистр, ё, дефисы), и каждое слово города тоже ключ:
+«петер» и «санкт петербург» находят «Санкт-Петербург». Нечёткий поиск
+(опечатки) — pg_trgm в БД, см. Database.search_autocomplete.
+"""
+import re
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+
+# Сколько совпадений префикса просматривать перед ранжированием по числу сервисов
+MAX_PREFIX_SCAN = 500
+
+
+def search_key(text: str) -> str:
+    text = text.lower().replace("ё", "е")
+    return re.sub(r"[\s\-‐–—.,]+", " ", text).strip()
+
+
+class CityPrefixIndex:
+    def __init__(self):
+        self._keys: list[tuple[str, str]] = []   # (ключ-префикс, ключ города)
+        # ключ города -> [название, число сервисов, {написание в БД: число сервисов}]
+        self._cities: dict[str, list] = {}
+
+    def __len__(self):
+        return len(self._cities)
+
+    def load(self, rows: Iterable[tuple[str, int]]):
+        """Полная перезагрузка: пары (город, число сервисов)"""
+        self._keys, self._cities = [], {}
+        for city, count in rows:
+            self._put(city, count)
+        self._keys.sort()
+
+    def add(self, city: str):
+        """Новый сервис в городе (NOTIFY services_changed)"""
+        self._put(city, 1, incremental=True)
+
+    def _put(self, city: str, count: int, incremental: bool = False):
+        city = city.strip()
+        key = search_key(city)
+        if not key:
+            return
+        entry = self._cities.get(key)
+        if entry:
+            # «Королёв» и «Королев» — один город: показываем самое частое написание
+            spellings = entry[2]
+            spellings[city] = spellings.get(city, 0) + count
+            entry[0] = min(spellings, key=lambda name: (-spellings[name], name))
+            entry[1] += count
+            return
+        self._cities[key] = [city, count, {city: count}]
+        words = key.split(" ")
+        for i in range(len(words)):
+            item = (" ".join(words[i:]), key)
+            if incremental:
+                insort(self._keys, item)
+            else:
+                self._keys.append(item)
+
+    def lookup(self, city: str) -> Optional[dict]:
+        """
+        Город из справочника, если запрос совпал с ним после нормализации.
+        spellings — все написания города в БД: сервисы ищутся по любому из них
+        """
+        entry = self._cities.get(search_key(city))
+        if not entry:
+            return None
+        return {"city": entry[0], "services": entry[1], "spellings": sorted(entry[2])}
+
+    def prefix(self, query: str, limit: int) -> list[dict]:
+        """Города, у которых название или одно из слов начинается с query; популярные первыми"""
+        query = search_key(query)
+        if not query:
+            return []
+        found = {}
+        i = bisect_left(self._keys, (query, ""))
+        while i < len(self._keys) and len(found) < MAX_PREFIX_SCAN:
+            prefix_key, key = self._keys[i]
+            if not prefix_key.startswith(query):
+                break
+            found[key] = self._cities[key]
+            i += 1
+        ranked = sorted(found.values(), key=lambda e: (-e[1], e[0]))
+        return [{"city": city, "services": count} for city, count, _ in ranked[:limit]]
@@ -0,0 +1,48 @@
+import cache
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    c = TTLCache(maxsize=10, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2, ttl=5)
+    clock.now += 30
+    assert c.get("a") == 1
+    assert c.get("b") is None
+    assert "b" not in c
+    clock.now += 31
+    assert c.get("a", "gone") == "gone"
+    # Протухшие записи удаляются при чтении
+    assert len(c) == 0
+
+
+def test_least_recently_used_is_evicted():
+    c = TTLCache(maxsize=3, ttl=60)
+    for key in "abc":
+        c.set(key, key)
+    assert c.get("a") == "a"  # "a" свежее "b" и "c"
+    c.set("d", "d")
+    assert "b" not in c
+    assert [key for key in "acd" if key in c] == ["a", "c", "d"]
+    c.set("c", "C")  # перезапись тоже освежает
+    c.set("e", "e")
+    assert "a" not in c
+    assert len(c) == 3
+
+
+def test_stats_count_hits_and_misses():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.get("a")
+    c.get("x")
+    assert c.stats() == {"size": 1, "maxsize": 2, "hits": 1, "misses": 1, "hit_rate": 0.5}
@@ -0,0 +1,32 @@
+import pytest
+
+from export import _csv_cell
+
+
+@pytest.mark.parametrize("payload", [
+    "=1+2",
+    "@SUM(A1:A2)",
+    "+1+cmd|' /C calc'!A0",
+    "-1+HYPERLINK(\"http://evil\", \"x\")",
+    "+7 (999) 123-45-67=cmd|' /C calc'!A0",
+    "-2+3",
+    "\t=cmd",
+    "\r=cmd",
+    "+cmd|' /C calc'!A0",
+])
+def test_formula_payloads_are_escaped(payload):
+    assert _csv_cell(payload) == "'" + payload
+
+
+@pytest.mark.parametrize("value", [
+    "+7 (999) 123-45-67",
+    "+79991234567",
+    "-15",
+    "8-800-555-35-35",
+    "Иван",
+    "",
+    42,
+    None,
+])
+def test_plain_values_pass_through(value):
+    assert _csv_cell(value) == value
@@ -0,0 +1,36 @@
+import random
+import time
+
+from geo import GeoGrid, haversine_km
+
+
+def brute_force(points, lat, lon, k, max_km):
+    found = sorted((haversine_km(lat, lon, p_lat, p_lon), key) for key, (p_lat, p_lon) in points.items())
+    return [round(d, 6) for d, _ in found if max_km is None or d <= max_km][:k]
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(1)
+    grid, points = GeoGrid(cell_deg=1.0), {}
+    for n in range(2000):
+        lat = rng.uniform(-90, 90) if n % 3 == 0 else rng.uniform(75, 90)
+        lon = rng.uniform(-180, 180)
+        grid.upsert(str(n), lat, lon, {"id": str(n)})
+        points[str(n)] = (lat, lon)
+    for _ in range(200):
+        lat, lon = rng.choice([rng.uniform(-90, 90), rng.uniform(80, 90), 90.0]), rng.uniform(-180, 180)
+        k, max_km = rng.randint(1, 15), rng.choice([None, 50, 100, 1000])
+        got = [round(d, 6) for d, _ in grid.nearest(lat, lon, k, max_km)]
+        assert got == brute_force(points, lat, lon, k, max_km)
+
+
+def test_high_latitude_query_is_bounded():
+    # Раньше окно у полюса почти не росло в км, и поиск обходил ~3600 колец (~20 с)
+    grid = GeoGrid(cell_deg=0.05)
+    grid.upsert("moscow", 55.75, 37.62, {"id": "moscow"})
+    grid.upsert("north", 80.01, 0.5, {"id": "north"})
+    for lat in (80.0, 89.0, 89.9, 90.0, -89.99):
+        started = time.perf_counter()
+        found = grid.nearest(lat, 0.0, 10, max_km=100)
+        assert time.perf_counter() - started < 0.5
+        assert [s["id"] for _, s in found] == (["north"] if lat == 80.0 else [])
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from group_commit import GroupCommitWriter
+
+
+class Recorder:
+    """flush, который запоминает пачки и может держать их в полёте"""
+
+    def __init__(self, results=None, error=None):
+        self.batches = []
+        self.results = results or (lambda items: [item * 10 for item in items])
+        self.error = error
+        self.inflight = 0
+        self.max_inflight = 0
+        self.release = None
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            if self.release is not None:
+                await self.release.wait()
+            if self.error:
+                raise self.error
+            return self.results(items)
+        finally:
+            self.inflight -= 1
+
+
+def test_batch_is_split_at_max_batch():
+    async def main():
+        flush = Recorder()
+        writer = GroupCommitWriter(flush, max_batch=3, max_wait=10, max_inflight=4)
+        results = await asyncio.gather(*(writer.submit(i) for i in range(7)))
+        await writer.close()
+        return flush, results
+
+    flush, results = asyncio.run(main())
+    assert results == [i * 10 for i in range(7)]
+    # Полные пачки уходят сразу, хвост — по close, не дожидаясь max_wait
+    assert flush.batches == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    async def main():
+        flush = Recorder()
+        writer = GroupCommitWriter(flush, max_batch=100, max_wait=0.05)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await asyncio.gather(writer.submit(1), writer.submit(2))
+        return flush, results, loop.time() - started
+
+    flush, results, elapsed = asyncio.run(main())
+    assert results == [10, 20]
+    assert flush.batches == [[1, 2]]
+    assert 0.04 <= elapsed < 1
+
+
+def test_item_error_goes_only_to_its_caller():
+    def results(items):
+        return [ValueError(item) if item == 1 else item for item in items]
+
+    async def main():
+        writer = GroupCommitWriter(Recorder(results), max_batch=3, max_wait=10)
+        return await asyncio.gather(*(writer.submit(i) for i in range(3)),
+                                    return_exceptions=True)
+
+    first, failed, last = asyncio.run(main())
+    assert (first, last) == (0, 2)
+    assert isinstance(failed, ValueError) and failed.args == (1,)
+
+
+def test_flush_error_goes_to_the_whole_batch():
+    async def main():
+        writer = GroupCommitWriter(Recorder(error=RuntimeError("db down")),
+                                   max_batch=2, max_wait=10)
+        return await asyncio.gather(writer.submit(1), writer.submit(2),
+                                    return_exceptions=True)
+
+    for result in asyncio.run(main()):
+        assert isinstance(result, RuntimeError)
+
+
+def test_inflight_batches_are_capped():
+    async def main():
+        flush = Recorder()
+        flush.release = asyncio.Event()
+        writer = GroupCommitWriter(flush, max_batch=2, max_wait=10, max_inflight=1)
+        pending = asyncio.gather(*(writer.submit(i) for i in range(5)))
+        await asyncio.sleep(0.01)
+        # Пока первая пачка коммитится, остальные копятся и ждут места
+        assert flush.batches == [[0, 1]]
+        flush.release.set()
+        results = await pending
+        await writer.close()
+        return flush, results
+
+    flush, results = asyncio.run(main())
+    assert results == [i * 10 for i in range(5)]
+    assert flush.max_inflight == 1
+    assert flush.batches == [[0, 1], [2, 3], [4]]
+
+
+def test_cancelled_caller_does_not_cancel_write():
+    async def main():
+        flush = Recorder()
+        flush.release = asyncio.Event()
+        writer = GroupCommitWriter(flush, max_batch=1, max_wait=10)
+        caller = asyncio.create_task(writer.submit(1))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        flush.release.set()
+        await writer.close()
+        return flush
+
+    assert asyncio.run(main()).batches == [[1]]
@@ -0,0 +1,122 @@
+"""
+Защита webapp_handler от шквала заявок.
+
+SubmissionLimitMiddleware пропускает заявку из web app, только если есть
+токен в бакете пользователя и в бакете сервиса и система не перегружена
+(заявок в обработке меньше SUBMIT_MAX_INFLIGHT, очередь к пулу БД короче
+SUBMIT_SHED_POOL_WAITERS). Отказ решается в памяти, до FSM и хендлера,
+и к БД не обращается. Предупреждение пользователю — не чаще раза в WARN_INTERVAL.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import Update
+
+from notifications import TokenBucket
+from metrics import SUBMISSIONS_REJECTED
+from config import (
+    SUBMIT_USER_PER_MINUTE, SUBMIT_USER_BURST,
+    SUBMIT_SERVICE_PER_MINUTE, SUBMIT_SERVICE_BURST,
+    SUBMIT_MAX_INFLIGHT, SUBMIT_SHED_POOL_WAITERS
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_BUCKETS = 10_000
+WARN_INTERVAL = 30
+
+REJECT_TEXT = {
+    "user": "⏳ Вы отправляете заявки слишком часто. Попробуйте через минуту.",
+    "service": "⏳ Этот автосервис сейчас получает слишком много заявок. Попробуйте чуть позже.",
+    "overload": "⏳ Сервис перегружен. Пожалуйста, отправьте заявку ещё раз через минуту.",
+}
+
+
+class BucketMap:
+    """Token bucket на ключ; самые давние ключи вытесняются сверх maxsize"""
+
+    def __init__(self, per_minute: float, burst: float, maxsize: int = MAX_BUCKETS):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[Any, TokenBucket] = OrderedDict()
+
+    def try_acquire(self, key) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.try_acquire()
+
+
+class SubmissionLimitMiddleware(BaseMiddleware):
+    def __init__(self, database):
+        self.database = database
+        self.users = BucketMap(SUBMIT_USER_PER_MINUTE, SUBMIT_USER_BURST)
+        self.services = BucketMap(SUBMIT_SERVICE_PER_MINUTE, SUBMIT_SERVICE_BURST)
+        self.inflight = 0
+        self._warned: OrderedDict[int, float] = OrderedDict()
+
+    def _reject_reason(self, user_id: int, service_id: Optional[str]) -> Optional[str]:
+        if (self.inflight >= SUBMIT_MAX_INFLIGHT
+                or self.database.pool_waiters() >= SUBMIT_SHED_POOL_WAITERS):
+            return "overload"
+        if not self.users.try_acquire(user_id):
+            return "user"
+        if service_id and not self.services.try_acquire(service_id):
+            return "service"
+        return None
+
+    def _should_warn(self, user_id: int) -> bool:
+        now = time.monotonic()
+        last = self._warned.get(user_id)
+        if last is not None and now - last < WARN_INTERVAL:
+            return False
+        self._warned[user_id] = now
+        self._warned.move_to_end(user_id)
+        if len(self._warned) > MAX_BUCKETS:
+            self._warned.popitem(last=False)
+        return True
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        message = event.message
+        if message is None or message.web_app_data is None or message.from_user is None:
+            return await handler(event, data)
+
+        try:
+            service_id = json.loads(message.web_app_data.data).get("service_id") or None
+        except (ValueError, AttributeError):
+            service_id = None  # битый JSON отклонит сам webapp_handler
+
+        user_id = message.from_user.id
+        reason = self._reject_reason(user_id, service_id)
+        if reason:
+            SUBMISSIONS_REJECTED.labels(reason).inc()
+            logger.warning("🚫 Заявка от %s отклонена: %s", user_id, reason)
+            if self._should_warn(user_id):
+                await message.answer(REJECT_TEXT[reason])
+            return None
+
+        self.inflight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.inflight -= 1
+
+
+def install(dp: Dispatcher, database):
+    """
+    Встать перед FSM-middleware aiogram: с FSM_STORAGE=postgres она читает
+    состояние из БД, а отказ должен обходиться без БД
+    """
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(SubmissionLimitMiddleware(database))
+    dp.update.outer_middleware(dp.fsm)
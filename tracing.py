@@ -0,0 +1,231 @@
+"""
+Трассировка запросов к БД в разрезе апдейтов (включается DB_TRACE=1).
+
+Middleware кладёт в contextvar трассу текущего апдейта, query logger asyncpg
+относит к ней каждый запрос. По завершении апдейта считаются round-trip'ы и
+время в БД, одинаковый оператор, повторённый DB_TRACE_REPEAT раз за апдейт,
+помечается как N+1. Медленные операторы один раз прогоняются через EXPLAIN.
+Сводка пишется в JSON при закрытии БД (Database.close) — см. QueryTracer.summary().
+"""
+import asyncio
+import heapq
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+current_trace: ContextVar[Optional["UpdateTrace"]] = ContextVar("current_trace", default=None)
+
+MAX_STATEMENTS = 1000
+MAX_PLANS = 50
+WORST_UPDATES = 20
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def normalize(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip()
+
+
+@dataclass
+class UpdateTrace:
+    update_id: int
+    kind: str
+    handler: str = "unhandled"
+    started: float = field(default_factory=time.perf_counter)
+    queries: int = 0
+    db_time: float = 0.0
+    statements: Counter = field(default_factory=Counter)
+
+
+@dataclass
+class StatementStats:
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    errors: int = 0
+
+
+class QueryTracer:
+    def __init__(self, database, slow_ms: float, repeat_threshold: int):
+        self.database = database
+        self.slow = slow_ms / 1000
+        self.repeat_threshold = repeat_threshold
+        self.statements: dict[str, StatementStats] = {}
+        self.plans: dict[str, dict] = {}
+        # handler -> агрегаты по апдейтам
+        self.handlers: dict[str, dict] = {}
+        # (statement, handler) -> {"updates": ..., "max_repeats": ...}
+        self.n_plus_one: dict[tuple[str, str], dict] = {}
+        self.worst: list[tuple] = []
+        self.updates = 0
+        self.untraced_queries = 0
+        self._explaining: set[str] = set()
+
+    # ----- сбор -----
+    def on_query(self, record):
+        """Query logger asyncpg; вызывается через call_soon в контексте запроса"""
+        statement = normalize(record.query)
+        if statement.startswith("EXPLAIN "):
+            return
+        stats = self.statements.get(statement)
+        if stats is None:
+            if len(self.statements) >= MAX_STATEMENTS:
+                return
+            stats = self.statements[statement] = StatementStats()
+        stats.calls += 1
+        stats.total += record.elapsed
+        stats.max = max(stats.max, record.elapsed)
+        if record.exception is not None:
+            stats.errors += 1
+
+        trace = current_trace.get()
+        if trace is not None:
+            trace.queries += 1
+            trace.db_time += record.elapsed
+            trace.statements[statement] += 1
+        else:
+            self.untraced_queries += 1
+
+        if (record.elapsed >= self.slow and record.exception is None
+                and statement not in self.plans and statement not in self._explaining
+                and len(self.plans) < MAX_PLANS and statement.upper().startswith(EXPLAINABLE)):
+            self._explaining.add(statement)
+            # Вне трассы апдейта: EXPLAIN не должен попасть в его счётчики
+            token = current_trace.set(None)
+            try:
+                asyncio.get_running_loop().create_task(
+                    self._explain(statement, record.query, record.args, record.elapsed)
+                )
+            finally:
+                current_trace.reset(token)
+
+    async def _explain(self, statement: str, query: str, args, elapsed: float):
+        try:
+            async with self.database.pool.acquire() as conn:
+                rows = await conn.fetch("EXPLAIN " + query, *(args or ()), timeout=5)
+            plan = "\n".join(r[0] for r in rows)
+            self.plans[statement] = {"elapsed_ms": round(elapsed * 1000, 2), "plan": plan}
+            logger.warning(f"🐢 Медленный запрос {elapsed * 1000:.1f} мс: {statement[:200]}\n{plan}")
+        except Exception as e:
+            logger.debug(f"EXPLAIN не удался: {e}")
+        finally:
+            self._explaining.discard(statement)
+
+    def finish(self, trace: UpdateTrace):
+        self.updates += 1
+        h = self.handlers.setdefault(
+            trace.handler, {"updates": 0, "queries": 0, "db_time": 0.0, "max_queries": 0}
+        )
+        h["updates"] += 1
+        h["queries"] += trace.queries
+        h["db_time"] += trace.db_time
+        h["max_queries"] = max(h["max_queries"], trace.queries)
+
+        repeated = {s: n for s, n in trace.statements.items() if n >= self.repeat_threshold}
+        for statement, n in repeated.items():
+            entry = self.n_plus_one.setdefault(
+                (statement, trace.handler), {"updates": 0, "max_repeats": 0}
+            )
+            entry["updates"] += 1
+            entry["max_repeats"] = max(entry["max_repeats"], n)
+        if repeated:
+            worst_statement, n = max(repeated.items(), key=lambda item: item[1])
+            logger.warning(
+                f"🔁 N+1 в {trace.handler} (апдейт {trace.update_id}): "
+                f"{n}× {worst_statement[:200]}"
+            )
+
+        item = (trace.db_time, trace.update_id, trace.kind, trace.handler, trace.queries,
+                time.perf_counter() - trace.started)
+        if len(self.worst) < WORST_UPDATES:
+            heapq.heappush(self.worst, item)
+        else:
+            heapq.heappushpop(self.worst, item)
+
+    # ----- отчёт -----
+    def summary(self, top: int = 10) -> dict:
+        ms = lambda seconds: round(seconds * 1000, 2)
+        total_queries = sum(h["queries"] for h in self.handlers.values())
+        return {
+            "updates": self.updates,
+            "queries_per_update": round(total_queries / max(self.updates, 1), 2),
+            "untraced_queries": self.untraced_queries,
+            "handlers": {
+                name: {
+                    "updates": h["updates"],
+                    "queries_per_update": round(h["queries"] / h["updates"], 2),
+                    "max_queries": h["max_queries"],
+                    "db_ms_per_update": ms(h["db_time"] / h["updates"]),
+                }
+                for name, h in sorted(self.handlers.items(), key=lambda kv: -kv[1]["queries"])
+            },
+            "top_statements": [
+                {"statement": s, "calls": st.calls, "total_ms": ms(st.total),
+                 "avg_ms": ms(st.total / st.calls), "max_ms": ms(st.max), "errors": st.errors}
+                for s, st in sorted(self.statements.items(), key=lambda kv: -kv[1].total)[:top]
+            ],
+            "n_plus_one": [
+                {"statement": s, "handler": handler, **entry}
+                for (s, handler), entry in sorted(
+                    self.n_plus_one.items(), key=lambda kv: -kv[1]["updates"]
+                )[:top]
+            ],
+            "worst_updates": [
+                {"update_id": update_id, "kind": kind, "handler": handler,
+                 "queries": queries, "db_ms": ms(db_time), "total_ms": ms(total)}
+                for db_time, update_id, kind, handler, queries, total
+                in sorted(self.worst, reverse=True)[:top]
+            ],
+            "slow_plans": [{"statement": s, **p} for s, p in self.plans.items()],
+        }
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        logger.info(f"📝 Трасса запросов к БД записана в {path}")
+
+
+# ===== AIOGRAM =====
+class UpdateTraceMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: открывает трассу до FSM и фильтров"""
+
+    def __init__(self, tracer: QueryTracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        trace = UpdateTrace(update_id=event.update_id, kind=event.event_type)
+        token = current_trace.set(trace)
+        try:
+            return await handler(event, data)
+        finally:
+            current_trace.reset(token)
+            # Query logger зовётся через call_soon — закрываем трассу после
+            # уже запланированных колбэков последних запросов
+            asyncio.get_running_loop().call_soon(self.tracer.finish, trace)
+
+
+class HandlerTraceMiddleware(BaseMiddleware):
+    """Inner-middleware: подписывает трассу именем сработавшего хендлера"""
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        trace = current_trace.get()
+        handler_object = data.get("handler")
+        if trace is not None and handler_object:
+            trace.handler = handler_object.callback.__name__
+        return await handler(event, data)
+
+
+def instrument_dispatcher(dp, tracer: QueryTracer):
+    dp.update.outer_middleware(UpdateTraceMiddleware(tracer))
+    dp.message.middleware(HandlerTraceMiddleware())
+    dp.callback_query.middleware(HandlerTraceMiddleware())